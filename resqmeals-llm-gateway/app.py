@@ -1,11 +1,45 @@
 import os
+import atexit
+import functools
+import hashlib
 import json
 import re
-import requests
-from flask import Flask, request, jsonify
+import signal
+from flask import Flask, Response, request, jsonify, stream_with_context
+import threading
 import time
-from datetime import datetime, timezone
-
+import uuid
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from batching import BatchScheduler, route_job, solve, vehicle_capacity
+from audit_export import EXPORT_FIELDS, audit_selector, iter_pages, stream_arrow, stream_ndjson
+from capacity import CapacityError, CapacityLedger
+from cloudant import (
+    _env,
+    _http,
+    cloudant_docs_with_prefix,
+    cloudant_find,
+    cloudant_find_partition,
+    cloudant_get,
+    cloudant_get_or_default,
+    cloudant_put,
+    cloudant_put_if_current,
+    cloudant_request,
+    cloudant_token,
+)
+from dedup import NearDuplicateIndex, facts as dedup_facts
+from hours import HoursCache, deadline_window, open_in_window
+from http_cache import BodyCache, compress, dumps, encoded_etag, etag_matches, pick_encoding, revision_etag
+from idempotency import IdempotencyStore
+from geo import geo_of, haversine_miles
+from job_board import JobBoard
+from locations import LocationStore
+from partitions import city_slug, nearest_city, parse_centroids, partition_from_id, partition_of, partitioned_id
+from rollups import GRANULARITIES, DIMENSIONS, RollupStore, bucket_range, build_counters, donation_portions, split_shards
+from warmup import Warmup
+
+_STARTED_AT = time.time()
 app = Flask(__name__)
 
 @app.errorhandler(Exception)
@@ -13,71 +47,223 @@ def handle_error(e):
     return jsonify({"error": str(e), "type": type(e).__name__}), 500
 
 
-@app.get("/__routes")
-def __routes():
-    return jsonify(sorted([rule.rule for rule in app.url_map.iter_rules()]))
-
-
-def _env(name: str) -> str:
-    v = os.environ.get(name)
-    if not v:
-        raise RuntimeError(f"Missing env var: {name}")
-    return v
+# ----------------------------
+# Shutdown
+# ----------------------------
+_shutdown_hooks = []
+_shutdown_lock = threading.Lock()
 
+def on_shutdown(fn):
+    """
+    Run fn once when the process exits, including on the SIGTERM Code Engine sends before
+    scaling an instance to zero. Used to flush state that is only held in memory.
+    """
+    _shutdown_hooks.append(fn)
+    return fn
+
+def _run_shutdown_hooks():
+    with _shutdown_lock:
+        hooks = list(_shutdown_hooks)
+        _shutdown_hooks.clear()
+    for fn in hooks:
+        try:
+            fn()
+        except Exception as e:
+            print(f"shutdown hook {getattr(fn, '__name__', fn)} failed: {e}", flush=True)
+
+def _on_sigterm(signum, frame):
+    # SystemExit unwinds the server loop; atexit then runs the hooks.
+    raise SystemExit(0)
+
+atexit.register(_run_shutdown_hooks)
+if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+    signal.signal(signal.SIGTERM, _on_sigterm)
+
+
+# ----------------------------
+# Conditional GET and compression
+# ----------------------------
+body_cache = BodyCache(max_entries=int(os.environ.get("BODY_CACHE_ENTRIES", "128")))
+
+def conditional_json(out: dict, *salt):
+    """
+    JSON response with a strong ETag built from the docs' _rev values and the query
+    (plus any salt for state that is not in _rev). Answers 304 with no body when
+    If-None-Match already holds that ETag, carrying the same (encoded) ETag the 200 would.
+    """
+    docs = out.get("docs") if isinstance(out.get("docs"), list) else [out]
+    etag = revision_etag(docs, request.path, sorted(request.args.items()), *salt)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    body = body_cache.get_or_build((etag, None), lambda: dumps(out))
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        encoding = _response_encoding(len(body))
+        if encoding:
+            headers["ETag"] = encoded_etag(etag, encoding)
+        headers["Vary"] = "Accept-Encoding"
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+def _response_encoding(length: int):
+    """
+    Encoding compress_response will apply to a body of this length, or None.
+    """
+    encoding = pick_encoding(request.headers.get("Accept-Encoding", ""))
+    if not encoding or length < int(os.environ.get("COMPRESS_MIN_BYTES", "1024")):
+        return None
+    return encoding
+
+@app.after_request
+def compress_response(resp):
+    if (
+        resp.status_code != 200
+        or resp.is_streamed
+        or resp.direct_passthrough
+        or "Content-Encoding" in resp.headers
+        or resp.mimetype not in ("application/json", "text/plain")
+    ):
+        return resp
+
+    resp.vary.add("Accept-Encoding")
+    encoding = _response_encoding(resp.content_length or 0)
+    if not encoding:
+        return resp
+
+    body = resp.get_data()
+    etag = resp.headers.get("ETag")
+    if etag:
+        data = body_cache.get_or_build((etag, encoding), lambda: compress(body, encoding))
+        resp.headers["ETag"] = encoded_etag(etag, encoding)
+    else:
+        data = compress(body, encoding)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
 
 
-IAM_URL = "https://iam.cloud.ibm.com/identity/token"
-_cloudant_token = {"value": None, "exp": 0}
-
-def cloudant_token() -> str:
-    now = int(time.time())
-    if _cloudant_token["value"] and now < _cloudant_token["exp"] - 60:
-        return _cloudant_token["value"]
-
-    r = requests.post(
-        IAM_URL,
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-        data={
-            "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-            "apikey": _env("CLOUDANT_APIKEY"),
-        },
-        timeout=20,
-    )
-    r.raise_for_status()
-    j = r.json()
-    _cloudant_token["value"] = j["access_token"]
-    _cloudant_token["exp"] = j["expiration"]
-    return _cloudant_token["value"]
-
-def cloudant_request(method: str, path: str, json_body=None, params=None):
-    base = _env("CLOUDANT_URL").rstrip("/")
-    token = cloudant_token()
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json",
-    }
-    url = f"{base}/{path.lstrip('/')}"
-    resp = requests.request(method, url, headers=headers, json=json_body, params=params, timeout=30)
-    resp.raise_for_status()
-    return resp.json() if resp.text else {}
-
-def cloudant_find(db: str, selector: dict, limit: int = 20, fields=None):
-    body = {"selector": selector, "limit": limit}
-    if fields:
-        body["fields"] = fields
-    return cloudant_request("POST", f"{db}/_find", json_body=body)
-
-def cloudant_get(db: str, doc_id: str):
-    return cloudant_request("GET", f"{db}/{doc_id}")
+@app.get("/__routes")
+def __routes():
+    return jsonify(sorted([rule.rule for rule in app.url_map.iter_rules()]))
 
-def cloudant_put(db: str, doc: dict):
-    if "_id" not in doc:
-        raise RuntimeError("document missing _id")
-    return cloudant_request("PUT", f"{db}/{doc['_id']}", json_body=doc)
 
+# ----------------------------
+# Idempotency keys
+# ----------------------------
+idempotency = IdempotencyStore(
+    ttl_s=float(os.environ.get("IDEMPOTENCY_TTL_S", "900")),
+    max_entries=int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "5000")),
+)
 
-def call_groq(system: str, user: str) -> str:
+def idempotent(fn):
+    """
+    Honor an Idempotency-Key header: retries share one computation and replay its response.
+    Keys are scoped per route; reusing a key with a different body is rejected with 422.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return fn(*args, **kwargs)
+
+        scoped = f"{request.path}:{key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        wait_s = float(os.environ.get("IDEMPOTENCY_WAIT_S", "90"))
+
+        while True:
+            role, entry = idempotency.begin(scoped, fingerprint)
+            if role == "conflict":
+                return jsonify({"error": "Idempotency-Key reused with a different request body"}), 422
+            if role == "replay":
+                return _replay(entry)
+            if role == "leader":
+                break
+            response = idempotency.wait(entry, wait_s)
+            if response is not None:
+                return _replay(response)
+            if not entry.done.is_set():
+                return jsonify({"error": "original request still in progress, retry later"}), 409
+            # The original failed; loop round and take over as leader.
+
+        try:
+            resp = app.make_response(fn(*args, **kwargs))
+        except Exception:
+            idempotency.fail(scoped, entry)
+            raise
+        if resp.status_code >= 500:
+            idempotency.fail(scoped, entry)
+        else:
+            idempotency.complete(scoped, entry, (resp.status_code, resp.mimetype, resp.get_data()))
+        return resp
+
+    return wrapper
+
+def _replay(stored):
+    status, mimetype, body = stored
+    return Response(body, status=status, mimetype=mimetype, headers={"Idempotent-Replayed": "true"})
+
+
+# ----------------------------
+# City partitions
+# ----------------------------
+# With CLOUDANT_PARTITIONED=1 the databases are Cloudant partitioned databases keyed by city
+# ("oslo:charity:x"); reads for one city use _partition/{city}/_find instead of a global scan.
+_city_centroids = parse_centroids(os.environ.get("CITY_CENTROIDS", ""))
+_restaurant_partitions = {}  # restaurant_id -> (partition, retry_at); retry_at is None for hits
+
+def _partitioned() -> bool:
+    return os.environ.get("CLOUDANT_PARTITIONED", "0") == "1"
+
+def _city_max_miles() -> float:
+    return float(os.environ.get("CITY_MAX_MILES", "60"))
+
+def find_scoped(db: str, selector: dict, partition=None, **kwargs):
+    if partition and _partitioned():
+        return cloudant_find_partition(db, partition, selector, **kwargs)
+    return cloudant_find(db, selector, **kwargs)
+
+def partition_for_restaurant(restaurant_id):
+    """
+    City partition of a restaurant: the prefix of a partitioned id, otherwise derived once
+    from the restaurant doc (city field, or nearest CITY_CENTROIDS entry to its geo).
+    Failed lookups are cached for RESTAURANT_CITY_RETRY_S.
+    """
+    if not restaurant_id:
+        return None
+    p = partition_from_id(restaurant_id)
+    if p:
+        return p
+    cached = _restaurant_partitions.get(restaurant_id)
+    if cached is not None and (cached[1] is None or cached[1] > time.time()):
+        return cached[0]
+    db = os.environ.get("CLOUDANT_DB_RESTAURANTS", "resqmeals_restaurants")
+    try:
+        doc = cloudant_get(db, restaurant_id)
+    except Exception:
+        # Unknown restaurant or Cloudant error: remember the miss for a while instead of
+        # retrying the GET on every request.
+        retry_s = float(os.environ.get("RESTAURANT_CITY_RETRY_S", "300"))
+        _restaurant_partitions[restaurant_id] = (None, time.time() + retry_s)
+        return None
+    _restaurant_partitions[restaurant_id] = (partition_of(doc, _city_centroids, _city_max_miles()), None)
+    return _restaurant_partitions[restaurant_id][0]
+
+def request_partition():
+    """
+    Partition for a read: ?city=, else the restaurant's city for ?restaurant_id=, else the
+    city nearest ?lat=&lon=. None (query every partition) when databases are not partitioned.
+    """
+    if not _partitioned():
+        return None
+    if request.args.get("city"):
+        return city_slug(request.args["city"])
+    if request.args.get("restaurant_id"):
+        return partition_for_restaurant(request.args["restaurant_id"])
+    lat, lon = request.args.get("lat"), request.args.get("lon")
+    if lat and lon:
+        return nearest_city(float(lat), float(lon), _city_centroids, _city_max_miles())
+    return None
+
+
+def call_groq(system: str, user: str, max_tokens=None) -> str:
     api_key = _env("GROQ_API_KEY")
     url = "https://api.groq.com/openai/v1/chat/completions"
 
@@ -88,10 +274,10 @@ def call_groq(system: str, user: str) -> str:
             {"role": "user", "content": user},
         ],
         "temperature": float(os.environ.get("LLM_TEMPERATURE", "0.2")),
-        "max_tokens": int(os.environ.get("LLM_MAX_TOKENS", "600")),
+        "max_tokens": max_tokens or int(os.environ.get("LLM_MAX_TOKENS", "600")),
     }
 
-    r = requests.post(
+    r = _http.post(
         url,
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
         json=body,
@@ -100,10 +286,10 @@ def call_groq(system: str, user: str) -> str:
     r.raise_for_status()
     return r.json()["choices"][0]["message"]["content"]
 
-def call_llm(system: str, user: str) -> str:
+def call_llm(system: str, user: str, max_tokens=None) -> str:
     provider = os.environ.get("LLM_PROVIDER", "groq").lower().strip()
     if provider == "groq":
-        return call_groq(system, user)
+        return call_groq(system, user, max_tokens=max_tokens)
     raise RuntimeError("Only groq provider is enabled in this build")
 
 def _force_json(text: str) -> str:
@@ -118,13 +304,63 @@ def _force_json(text: str) -> str:
 
 @app.get("/health")
 def health():
-    return jsonify({"ok": True})
+    # Liveness only. Use /ready to know whether warm-up has finished.
+    return jsonify({"ok": True, "ready": warmup.ready.is_set()})
+
+@app.get("/ready")
+def ready():
+    if not warmup.ready.is_set():
+        return jsonify({"ready": False, "release": warmup.release}), 503
+    return jsonify({"ready": True, **warmup.report})
+
+# ----------------------------
+# Near-duplicate donations
+# ----------------------------
+near_dupes = NearDuplicateIndex(
+    threshold=float(os.environ.get("DEDUP_THRESHOLD", "0.6")),
+    window_s=float(os.environ.get("DEDUP_WINDOW_S", "7200")),
+    num_perm=int(os.environ.get("DEDUP_NUM_PERM", "64")),
+    bands=int(os.environ.get("DEDUP_BANDS", "16")),
+)
+
+def _dedup_scope(restaurant_id) -> str:
+    if os.environ.get("DEDUP_SCOPE", "restaurant") == "global":
+        return "*"
+    return restaurant_id or "unknown"
+
+@app.post("/dedup/check")
+def dedup_check():
+    """
+    Look up a message against recent posts without recording it.
+    """
+    payload = request.get_json(force=True)
+    match = near_dupes.query(payload.get("text", ""), _dedup_scope(payload.get("restaurant_id")))
+    if match:
+        match = {k: match[k] for k in ("message_id", "similarity", "received_at")}
+    return jsonify({"duplicate_of": match})
 
 @app.post("/llm/extract_donation")
+@idempotent
 def extract_donation():
     payload = request.get_json(force=True)
     msg = payload.get("text", "")
 
+    # Near-duplicates of a recent post are flagged ("flag" mode), or in "merge" mode reuse its
+    # extraction when their numbers and times match. allow_duplicate=true skips the check.
+    match, message_id = None, None
+    if not payload.get("allow_duplicate"):
+        match, message_id = near_dupes.check_and_add(msg, _dedup_scope(payload.get("restaurant_id")))
+        if match:
+            duplicate_of = {k: match[k] for k in ("message_id", "similarity", "received_at")}
+            if (
+                match["result"] is not None
+                and os.environ.get("DEDUP_MODE", "flag") == "merge"
+                and match["facts"] == dedup_facts(msg)
+            ):
+                # The resend carries the merged result too, so later posts closest to it also merge.
+                near_dupes.set_result(message_id, match["result"])
+                return jsonify({"json": match["result"], "message_id": match["message_id"], "duplicate_of": duplicate_of})
+
     system = "You extract structured food donation details. Return ONLY valid JSON."
     user = f"""
 Extract JSON with keys:
@@ -138,14 +374,44 @@ Message:
 {msg}
 """.strip()
 
-    out = call_llm(system, user)
-    return jsonify({"json": _force_json(out)})
+    try:
+        out = _force_json(call_llm(system, user))
+    except Exception:
+        # A failed attempt must not be reported as the original when the operator retries.
+        if message_id is not None:
+            near_dupes.discard(message_id)
+        raise
+    resp = {"json": out}
+    if message_id is not None:
+        near_dupes.set_result(message_id, out)
+        resp["message_id"] = message_id
+    if match:
+        resp["duplicate_of"] = duplicate_of
+    return jsonify(resp)
 
 @app.route("/llm/rank_charities", methods=["POST"])
+@idempotent
 def rank_charities():
     data = request.get_json(force=True)
     donation = data.get("donation")
     candidates = data.get("candidates", [])
+    category = data.get("category")
+
+    # /llm/extract_donation returns the donation as a JSON string; accept either form.
+    donation_obj = donation
+    if isinstance(donation, str):
+        donation_obj, _ = _safe_parse_json(donation)
+    if not isinstance(donation_obj, dict):
+        donation_obj = {}
+
+    # Saturated charities are dropped from the in-memory ledger before the LLM sees them.
+    portions = donation_portions(donation_obj)
+    today = _local_now().date().isoformat()
+    saturated = [c.get("_id") for c in candidates if capacity_ledger.is_saturated(c, today, portions, category)]
+    candidates = [c for c in candidates if c.get("_id") not in saturated]
+    if not candidates:
+        return jsonify({"ranked": [], "saturated": saturated})
+    candidates = _annotate_open_at_pickup(candidates, donation_obj.get("pickup_deadline"))
 
     system = "You are a dispatch assistant that ranks charities for food rescue."
     user = f"""
@@ -168,7 +434,7 @@ Return JSON only with this schema:
 Rules:
 - Prefer charities that accept the food type.
 - Prefer larger max_radius_miles.
-- Prefer charities whose hours are open at pickup_deadline if hours exist.
+- Prefer charities with open_at_pickup true. Treat null as unknown, ranked below true and above false.
 - Keep reason under 20 words.
 """
 
@@ -193,7 +459,8 @@ Rules:
 
     def _fallback():
         ranked = []
-        for c in candidates:
+        order = {True: 0, None: 1, False: 2}
+        for c in sorted(candidates, key=lambda c: order[c.get("open_at_pickup")]):
             ranked.append({
                 "id": c.get("_id"),
                 "name": c.get("name"),
@@ -206,12 +473,14 @@ Rules:
         out = _coerce(raw)
         if not out.get("ranked"):
             out = _fallback()
-        return jsonify(out)
     except Exception:
-        return jsonify(_fallback())
+        out = _fallback()
+    out["saturated"] = saturated
+    return jsonify(out)
 
 
 @app.post("/llm/draft_driver_message")
+@idempotent
 def draft_driver_message():
     payload = request.get_json(force=True)
 
@@ -228,6 +497,7 @@ Data:
     return jsonify({"text": out.strip()})
 
 @app.post("/llm/generate_receipt")
+@idempotent
 def generate_receipt():
     payload = request.get_json(force=True)
 
@@ -266,47 +536,257 @@ def audit_recent():
 
     # Find all audit docs. For small demo dataset this is fine.
     # If you want sorting by created_at later, add an index and sort fields.
-    out = cloudant_find(
+    out = find_scoped(
         db,
         {"type": "audit"},
+        partition=request_partition(),
         limit=limit,
-        fields=["_id","created_at","restaurant_id","status","restaurant_message","selected_charity","selected_driver"]
+        fields=["_id","_rev","created_at","restaurant_id","status","restaurant_message","selected_charity","selected_driver"]
+    )
+    return conditional_json(out)
+
+
+EXPORT_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+@app.get("/audit/export")
+def audit_export():
+    """
+    Stream flattened audit rows (one per food item) as ndjson, Arrow IPC or Parquet.
+    Filters: ?since=&until= (ISO timestamps on created_at) and ?restaurant_id=.
+    """
+    db = os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
+    fmt = request.args.get("format", "ndjson").lower()
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"error": f"unsupported format: {fmt}", "formats": sorted(EXPORT_MIMETYPES)}), 400
+
+    page_size = max(1, min(int(request.args.get("page_size", "200")), 1000))
+    selector = audit_selector(
+        since=request.args.get("since"),
+        until=request.args.get("until"),
+        restaurant_id=request.args.get("restaurant_id"),
     )
+    find = functools.partial(find_scoped, partition=request_partition())
+    pages = iter_pages(find, db, selector, page_size, fields=EXPORT_FIELDS)
+
+    if fmt == "ndjson":
+        body = stream_ndjson(pages)
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return jsonify({"error": f"{fmt} export requires pyarrow"}), 501
+        body = stream_arrow(pages, fmt)
+
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=resqmeals_audit.{fmt}"},
+    )
+
+
+# ----------------------------
+# Charity opening hours
+# ----------------------------
+charity_hours_cache = HoursCache()
+
+def _local_now() -> datetime:
+    return datetime.now(ZoneInfo(os.environ.get("LOCAL_TZ", "UTC")))
+
+def _pickup_window(pickup_deadline):
+    return deadline_window(pickup_deadline, _local_now()) if pickup_deadline else None
+
+def _annotate_open_at_pickup(candidates: list, pickup_deadline) -> list:
+    window = _pickup_window(pickup_deadline)
+    if window is None:
+        return candidates
+    flags = open_in_window(charity_hours_cache.bitmaps(candidates), *window)
+    return [{**c, "open_at_pickup": flag} for c, flag in zip(candidates, flags)]
+
+@app.post("/hours/open")
+def hours_open():
+    """
+    Which candidate charities are open in a window, for the whole candidate set in one pass.
+    Body: {"candidates": [...charity docs...], "window": {"start": iso, "end": iso}}
+    or {"candidates": [...], "pickup_deadline": "after 3pm"}; optional "mode": "any" | "all".
+    """
+    payload = request.get_json(force=True)
+    candidates = payload.get("candidates", [])
+    mode = payload.get("mode", "any")
+
+    tz = ZoneInfo(os.environ.get("LOCAL_TZ", "UTC"))
+    if payload.get("window"):
+        window = tuple(
+            datetime.fromisoformat(payload["window"][k]).astimezone(tz) for k in ("start", "end")
+        )
+    else:
+        window = _pickup_window(payload.get("pickup_deadline"))
+    if window is None:
+        return jsonify({"error": "missing window or unparseable pickup_deadline"}), 400
+
+    flags = open_in_window(charity_hours_cache.bitmaps(candidates), *window, mode=mode)
+    grouped = {True: "open", False: "closed", None: "unknown"}
+    out = {"window": {"start": window[0].isoformat(), "end": window[1].isoformat()}, "mode": mode,
+           "open": [], "closed": [], "unknown": []}
+    for c, flag in zip(candidates, flags):
+        out[grouped[flag]].append(c.get("_id"))
     return jsonify(out)
 
 
-@app.get("/data/charities")
-def charities():
+# ----------------------------
+# Charity capacity reservations
+# ----------------------------
+capacity_ledger = CapacityLedger(default_ttl_s=int(os.environ.get("CAPACITY_HOLD_TTL_S", "3600")))
+
+def _charities_db() -> str:
+    return os.environ.get("CLOUDANT_DB_CHARITIES", "resqmeals_charities")
+
+def _load_ledger_doc(doc_id: str) -> dict:
+    return cloudant_get_or_default(_charities_db(), doc_id, {})
+
+def _save_ledger_doc(doc: dict) -> bool:
+    return cloudant_put_if_current(_charities_db(), doc)
+
+def _reservation_args(payload: dict):
+    return (
+        payload.get("charity_id"),
+        payload.get("day") or _local_now().date().isoformat(),
+        payload.get("reservation_id"),
+    )
+
+@app.post("/capacity/reserve")
+@idempotent
+def capacity_reserve():
+    """
+    Atomically reserve portions at a charity for today.
+    Body: {"charity_id", "portions" or "donation", "category"?, "ttl_s"?}. 409 when the charity is full.
+    """
+    payload = request.get_json(force=True)
+    charity_id = payload.get("charity_id")
+    if not charity_id:
+        return jsonify({"error": "missing charity_id"}), 400
+
+    charity = cloudant_get(_charities_db(), charity_id)
+    try:
+        out = capacity_ledger.reserve(
+            charity,
+            _local_now().date().isoformat(),
+            # Unparseable quantities ("a lot of bread") still hold one portion, as in batching.
+            float(payload.get("portions") or max(1.0, donation_portions(payload.get("donation")))),
+            _load_ledger_doc,
+            _save_ledger_doc,
+            category=payload.get("category"),
+            ttl_s=payload.get("ttl_s"),
+        )
+    except CapacityError as e:
+        return jsonify({"error": str(e), "charity_id": charity_id}), 409
+    return jsonify(out)
+
+@app.post("/capacity/release")
+def capacity_release():
+    charity_id, day, rid = _reservation_args(request.get_json(force=True))
+    if not charity_id or not rid:
+        return jsonify({"error": "missing charity_id or reservation_id"}), 400
+    return jsonify({"released": capacity_ledger.release(charity_id, day, rid, _load_ledger_doc, _save_ledger_doc)})
+
+@app.post("/capacity/confirm")
+def capacity_confirm():
+    charity_id, day, rid = _reservation_args(request.get_json(force=True))
+    if not charity_id or not rid:
+        return jsonify({"error": "missing charity_id or reservation_id"}), 400
+    return jsonify({"confirmed": capacity_ledger.confirm(charity_id, day, rid, _load_ledger_doc, _save_ledger_doc)})
+
+@app.get("/capacity/status")
+def capacity_status():
+    charity_id = request.args.get("charity_id")
+    if not charity_id:
+        return jsonify({"error": "missing charity_id"}), 400
+    charity = cloudant_get(_charities_db(), charity_id)
+    return jsonify(capacity_ledger.status(charity, _local_now().date().isoformat()))
+
+
+# ----------------------------
+# Reference data
+# ----------------------------
+# Short-lived cache so the sets preloaded during warm-up serve the first requests after a cold start.
+_reference_cache = {}
+
+def _cached_reference(key: tuple, load):
+    ttl = float(os.environ.get("REFERENCE_CACHE_S", "15"))
+    hit = _reference_cache.get(key)
+    if hit and time.time() - hit[0] < ttl:
+        return hit[1]
+    out = load()
+    _reference_cache[key] = (time.time(), out)
+    return out
+
+def find_charities(accepts=None, partition=None) -> dict:
     db = os.environ.get("CLOUDANT_DB_CHARITIES", "resqmeals_charities")
-    accepts = request.args.get("accepts")  # comma separated
     sel = {"type": "charity"}
 
-    if accepts:
-        vals = [v.strip() for v in accepts.split(",") if v.strip()]
+    vals = sorted({v.strip() for v in (accepts or "").split(",") if v.strip()})
+    if vals:
         sel["accepts"] = {"$in": vals}
 
-    out = cloudant_find(
+    return _cached_reference(("charities", tuple(vals), partition), lambda: find_scoped(
         db,
         sel,
+        partition=partition,
         limit=50,
-        fields=["_id","name","accepts","max_radius_miles","address","hours","capacity_notes","geo"]
-    )
-    return jsonify(out)
+        fields=["_id","_rev","name","accepts","max_radius_miles","address","hours","capacity","capacity_notes","geo"]
+    ))
+
+def find_drivers(status: str = "available", partition=None) -> dict:
+    db = os.environ.get("CLOUDANT_DB_DRIVERS", "resqmeals_drivers")
+    sel = {"type": "driver", "status": status}
+    return _cached_reference(("drivers", status, partition), lambda: find_scoped(
+        db, sel, partition=partition, limit=50, fields=["_id","_rev","name","status","max_radius_miles","vehicle","channels","rating","geo"]
+    ))
+
+def find_restaurants(partition=None) -> dict:
+    db = os.environ.get("CLOUDANT_DB_RESTAURANTS", "resqmeals_restaurants")
+    return _cached_reference(("restaurants", partition), lambda: find_scoped(
+        db, {"type": "restaurant"}, partition=partition, limit=50, fields=["_id","_rev","name","address","geo","contact"]
+    ))
+
+@app.get("/data/charities")
+def charities():
+    # accepts is comma separated; ?city= / ?restaurant_id= / ?lat=&lon= scope to one city partition
+    return conditional_json(find_charities(request.args.get("accepts"), request_partition()))
 
 
 @app.get("/data/drivers")
 def drivers():
-    db = os.environ.get("CLOUDANT_DB_DRIVERS", "resqmeals_drivers")
-    status = request.args.get("status", "available")
-    sel = {"type": "driver", "status": status}
-    out = cloudant_find(db, sel, limit=50, fields=["_id","name","status","max_radius_miles","vehicle","channels","rating","geo"])
-    return jsonify(out)
+    """
+    Driver docs with geo replaced by the latest live fix when one is fresh enough.
+    ?lat=&lon=&radius_miles= keeps only drivers within that radius, nearest first.
+    """
+    out = find_drivers(request.args.get("status", "available"), request_partition())
+    docs = _with_live_positions(out.get("docs", []))
+
+    lat, lon, radius = request.args.get("lat"), request.args.get("lon"), request.args.get("radius_miles")
+    if lat and lon and radius:
+        lat, lon, radius = float(lat), float(lon), float(radius)
+        ranked = []
+        for d in docs:
+            pos = geo_of(d)
+            if pos is None:
+                continue
+            miles = haversine_miles(lat, lon, pos[0], pos[1])
+            if miles <= radius:
+                ranked.append((miles, {**d, "distance_miles": round(miles, 2)}))
+        docs = [d for _, d in sorted(ranked, key=lambda r: r[0])]
+
+    # The overlaid fixes shape the body but not the docs' _rev; a fix ageing out changes it too.
+    live = [(d["_id"], d["geo"]["ts"]) for d in docs if (d.get("geo") or {}).get("live")]
+    return conditional_json({**out, "docs": docs}, live)
 
 @app.get("/data/restaurants")
 def restaurants():
-    db = os.environ.get("CLOUDANT_DB_RESTAURANTS", "resqmeals_restaurants")
-    out = cloudant_find(db, {"type": "restaurant"}, limit=50, fields=["_id","name","address","geo","contact"])
-    return jsonify(out)
+    return conditional_json(find_restaurants(request_partition()))
 
 @app.get("/data/doc")
 def get_doc():
@@ -314,9 +794,10 @@ def get_doc():
     doc_id = request.args.get("id")
     if not db or not doc_id:
         return jsonify({"error":"missing db or id"}), 400
-    return jsonify(cloudant_get(db, doc_id))
+    return conditional_json(cloudant_get(db, doc_id))
 
 @app.post("/audit/log")
+@idempotent
 def audit_log():
     payload = request.get_json(force=True)
     db = os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
@@ -324,16 +805,592 @@ def audit_log():
     ts = datetime.now(timezone.utc).isoformat()
     restaurant_id = payload.get("restaurant_id", "unknown")
 
+    doc_id = f"audit:{ts}:{restaurant_id}"
+    partition = partition_for_restaurant(restaurant_id) if _partitioned() else None
+
     doc = {
-        "_id": f"audit:{ts}:{restaurant_id}",
+        "_id": partitioned_id(partition, doc_id) if partition else doc_id,
         "type": "audit",
         "created_at": ts,
         **payload
     }
 
     out = cloudant_put(db, doc)
+    rollups.record(doc)
+    _maybe_checkpoint_rollups()
+    return jsonify(out)
+
+
+# ----------------------------
+# Dispatch aggregates
+# ----------------------------
+ROLLUP_DOC_PREFIX = "rollup:"
+rollups = RollupStore(
+    hour_retention_days=int(os.environ.get("ROLLUP_HOUR_RETENTION_DAYS", "14")),
+    day_retention_days=int(os.environ.get("ROLLUP_DAY_RETENTION_DAYS", "400")),
+)
+
+def _rollup_doc_id(shard: str) -> str:
+    return ROLLUP_DOC_PREFIX + shard
+
+def _load_rollup_shard(shard: str) -> dict:
+    db = os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
+    gran, month = shard.split(":", 1)
+    doc_id = _rollup_doc_id(shard)
+    return cloudant_get_or_default(db, doc_id, {"_id": doc_id, "type": "rollup", "granularity": gran, "month": month})
+
+def _load_rollup_docs() -> list:
+    """
+    Every checkpoint shard (rollup:hour:2026-10, rollup:day:2026-10, ...) in one request.
+    """
+    db = os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
+    return [d for d in cloudant_docs_with_prefix(db, ROLLUP_DOC_PREFIX) if d.get("type") == "rollup"]
+
+def _save_rollup_doc(doc: dict) -> bool:
+    return cloudant_put_if_current(os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit"), doc)
+
+def _maybe_checkpoint_rollups():
+    if rollups.checkpoint_due(float(os.environ.get("ROLLUP_CHECKPOINT_S", "60"))):
+        threading.Thread(target=_checkpoint_rollups, daemon=True).start()
+
+def _checkpoint_rollups():
+    try:
+        rollups.checkpoint(_load_rollup_shard, _save_rollup_doc)
+    except Exception as e:
+        print(f"rollup checkpoint failed: {e}", flush=True)
+
+def _rollup_flush_loop():
+    # Writes only trigger a checkpoint once the interval has passed, so the tail of a burst
+    # would otherwise wait for the next write; flush it on a timer instead.
+    while True:
+        interval = float(os.environ.get("ROLLUP_CHECKPOINT_S", "60"))
+        time.sleep(interval)
+        if rollups.checkpoint_due(interval):
+            _checkpoint_rollups()
+
+def _flush_rollups_on_shutdown():
+    try:
+        rollups.flush(_load_rollup_shard, _save_rollup_doc)
+    except Exception as e:
+        print(f"rollup flush on shutdown failed: {e}", flush=True)
+
+threading.Thread(target=_rollup_flush_loop, name="rollup-flush", daemon=True).start()
+on_shutdown(_flush_rollups_on_shutdown)
+
+@app.get("/stats/rollup")
+def stats_rollup():
+    """
+    Dispatches and portions per bucket for one dimension (all, restaurant, charity, driver).
+    ?granularity=hour|day, ?since=&until= (ISO, defaults to the last 48 hours / 14 days), ?key=.
+    """
+    gran = request.args.get("granularity", "day")
+    dim = request.args.get("dim", "all")
+    if gran not in GRANULARITIES or dim not in DIMENSIONS:
+        return jsonify({"error": "bad granularity or dim", "granularities": sorted(GRANULARITIES), "dims": list(DIMENSIONS)}), 400
+
+    if rollups.refresh_due(float(os.environ.get("ROLLUP_REFRESH_S", "60"))):
+        rollups.load(_load_rollup_docs())
+
+    now = datetime.now(timezone.utc)
+    default_since = now - (timedelta(hours=47) if gran == "hour" else timedelta(days=13))
+    buckets = bucket_range(
+        gran,
+        request.args.get("since") or default_since.isoformat(),
+        request.args.get("until") or now.isoformat(),
+        max_buckets=int(os.environ.get("ROLLUP_MAX_BUCKETS", "400")),
+    )
+    rows = rollups.query(gran, dim, buckets, key=request.args.get("key"))
+    return jsonify({"granularity": gran, "dim": dim, "buckets": buckets, "rows": rows})
+
+@app.post("/stats/rollup/rebuild")
+def stats_rollup_rebuild():
+    """
+    Backfill: rescan every audit document and overwrite the rollup checkpoint shards.
+    """
+    db = os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
+    fields = ["_id", "created_at", "restaurant_id", "extracted", "selected_charity", "selected_driver"]
+    pages = iter_pages(cloudant_find, db, {"type": "audit"}, 500, fields=fields)
+    counters = build_counters(doc for docs in pages for doc in docs)
+
+    shards = {_rollup_doc_id(shard): dims for shard, dims in split_shards(counters).items()}
+    existing = {d["_id"]: d for d in _load_rollup_docs()}
+    now = datetime.now(timezone.utc).isoformat()
+    # Every shard gets the new generation, so other instances drop the pending increments
+    # this scan already counted instead of checkpointing them again. Shards with no audits
+    # left (and the pre-sharding rollup:dispatch doc) are emptied.
+    generation = uuid.uuid4().hex[:8]
+    for doc_id in sorted(set(shards) | set(existing)):
+        doc = existing.get(doc_id) or _load_rollup_shard(doc_id[len(ROLLUP_DOC_PREFIX):])
+        doc.update({"counters": shards.get(doc_id, {}), "generation": generation, "updated_at": now})
+        if not _save_rollup_doc(doc):
+            return jsonify({"error": "rollup checkpoint changed during rebuild, retry"}), 409
+    rollups.replace(counters, generation)
+    return jsonify({"ok": True})
+
+
+# ----------------------------
+# Live job feed
+# ----------------------------
+job_board = JobBoard(
+    max_events=int(os.environ.get("JOB_FEED_MAX_EVENTS", "2000")),
+    default_ttl_s=int(os.environ.get("JOB_TTL_S", "3600")),
+)
+
+def _feed_filter_args():
+    lat, lon = request.args.get("lat"), request.args.get("lon")
+    radius = request.args.get("radius_miles")
+    near = (float(lat), float(lon)) if lat and lon else None
+    return near, float(radius) if radius else None
+
+def _restaurant_geo(restaurant_id: str):
+    db = os.environ.get("CLOUDANT_DB_RESTAURANTS", "resqmeals_restaurants")
+    try:
+        return cloudant_get(db, restaurant_id).get("geo")
+    except Exception:
+        return None
+
+@app.post("/jobs")
+@idempotent
+def jobs_publish():
+    payload = request.get_json(force=True)
+    job = {k: v for k, v in payload.items() if k != "ttl_s"}
+    if not job.get("geo") and job.get("restaurant_id"):
+        job["geo"] = _restaurant_geo(job["restaurant_id"])
+
+    ttl_s = payload.get("ttl_s")
+    return jsonify(job_board.publish(job, ttl_s=ttl_s if ttl_s is not None else _job_ttl(job)))
+
+def _clean_reservation(reservation):
+    """
+    A client-supplied reservation as a dict with a numeric "expires" (dropped if unparseable), or None.
+    """
+    if not isinstance(reservation, dict):
+        return None
+    out = dict(reservation)
+    if out.get("expires") is not None:
+        try:
+            out["expires"] = float(out["expires"])
+        except (TypeError, ValueError):
+            out.pop("expires")
+    return out
+
+def _job_reservations(job: dict) -> list:
+    reservations = job.get("reservations")
+    if not isinstance(reservations, list):
+        reservations = [job.get("reservation")]
+    return [r for r in map(_clean_reservation, reservations) if r]
+
+def _job_ttl(job: dict):
+    # A job expires together with the (earliest) charity hold it carries.
+    expires = [r["expires"] for r in _job_reservations(job) if r.get("expires")]
+    return max(60, int(min(expires) - time.time())) if expires else None
+
+@app.post("/jobs/<job_id>/accept")
+def jobs_accept(job_id):
+    payload = request.get_json(force=True)
+    ok, msg, job = job_board.accept(job_id, payload.get("driver_id", ""), payload.get("driver_name", ""))
+    if not ok:
+        return jsonify({"ok": False, "error": msg, "job": job}), 404 if job is None else 409
+
+    # An accepted job keeps its charity reservations past the holds' expiry.
+    for reservation in _job_reservations(job):
+        if not reservation.get("reservation_id"):
+            continue
+        try:
+            capacity_ledger.confirm(
+                reservation["charity_id"], reservation["day"], reservation["reservation_id"],
+                _load_ledger_doc, _save_ledger_doc,
+            )
+        except Exception as e:
+            print(f"capacity confirm failed for {job_id}: {e}", flush=True)
+    return jsonify({"ok": True, "job": job})
+
+@app.get("/jobs/changes")
+def jobs_changes():
+    """
+    Long-poll: returns open-job deltas after ?since=<seq>, waiting up to ?wait=<s> for one.
+    Pass back ?epoch= from the last response so a restarted gateway answers with a reset.
+    """
+    since = int(request.args.get("since", "0"))
+    wait = min(float(request.args.get("wait", "0")), float(os.environ.get("JOB_FEED_MAX_WAIT_S", "25")))
+    near, radius = _feed_filter_args()
+    epoch = request.args.get("epoch")
+    return jsonify(job_board.changes(since, wait_s=wait, near=near, radius_miles=radius, epoch=epoch))
+
+@app.get("/jobs/stream")
+def jobs_stream():
+    """
+    Server-sent events variant of /jobs/changes. Resumes from Last-Event-ID when reconnecting.
+    """
+    since = int(request.headers.get("Last-Event-ID") or request.args.get("since", "0"))
+    near, radius = _feed_filter_args()
+    heartbeat = float(os.environ.get("JOB_FEED_HEARTBEAT_S", "15"))
+
+    def _events(since):
+        while True:
+            out = job_board.changes(since, wait_s=heartbeat, near=near, radius_miles=radius)
+            if out["reset"]:
+                yield f"id: {out['seq']}\nevent: reset\ndata: {json.dumps(out['jobs'])}\n\n"
+            for e in out["events"]:
+                yield f"id: {e['seq']}\nevent: {e['kind']}\ndata: {json.dumps(e['job'])}\n\n"
+            if not out["reset"] and not out["events"]:
+                yield ": keepalive\n\n"
+            since = out["seq"]
+
+    return Response(
+        stream_with_context(_events(since)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ----------------------------
+# Live driver locations
+# ----------------------------
+LOCATION_SNAPSHOT_ID = "driver_locations:snapshot"
+driver_locations = LocationStore(
+    cell_deg=float(os.environ.get("LOCATION_CELL_DEG", "0.05")),
+    max_skew_s=float(os.environ.get("LOCATION_MAX_SKEW_S", "30")),
+)
+_location_snapshot = {"at": time.time(), "running": False}
+
+def _drivers_db() -> str:
+    return os.environ.get("CLOUDANT_DB_DRIVERS", "resqmeals_drivers")
+
+def _with_live_positions(docs: list) -> list:
+    max_age = float(os.environ.get("LOCATION_MAX_AGE_S", "900"))
+    now = time.time()
+    out = []
+    for d in docs:
+        fix = driver_locations.position(d.get("_id"))
+        if fix and now - fix[2] <= max_age:
+            d = {**d, "geo": {"lat": fix[0], "lon": fix[1], "ts": fix[2], "live": True}}
+        out.append(d)
+    return out
+
+def _load_location_snapshot():
+    doc = cloudant_get_or_default(_drivers_db(), LOCATION_SNAPSHOT_ID, {})
+    driver_locations.load(doc.get("positions"))
+
+def _save_location_snapshot():
+    """
+    Merge this instance's latest fixes into the shared snapshot doc (newest fix wins).
+    """
+    try:
+        for _ in range(5):
+            doc = cloudant_get_or_default(
+                _drivers_db(), LOCATION_SNAPSHOT_ID, {"_id": LOCATION_SNAPSHOT_ID, "type": "location_snapshot"}
+            )
+            positions = doc.get("positions") or {}
+            for did, fix in driver_locations.snapshot().items():
+                if did not in positions or positions[did][2] < fix[2]:
+                    positions[did] = fix
+            doc.update({"positions": positions, "updated_at": datetime.now(timezone.utc).isoformat()})
+            if cloudant_put_if_current(_drivers_db(), doc):
+                return
+        print("driver location snapshot: too many _rev conflicts", flush=True)
+    except Exception as e:
+        print(f"driver location snapshot failed: {e}", flush=True)
+    finally:
+        _location_snapshot["running"] = False
+
+def _maybe_snapshot_locations():
+    interval = float(os.environ.get("LOCATION_SNAPSHOT_S", "60"))
+    if _location_snapshot["running"] or time.time() - _location_snapshot["at"] < interval:
+        return
+    _location_snapshot.update({"running": True, "at": time.time()})
+    threading.Thread(target=_save_location_snapshot, daemon=True).start()
+
+@app.post("/drivers/locations")
+def drivers_locations():
+    """
+    Batched GPS ingest: {"updates": [{"driver_id", "lat", "lon", "ts"?}, ...]}
+    or the compact form {"updates": [[driver_id, lat, lon, ts?], ...]}. Only the newest fix per driver is kept.
+    """
+    payload = request.get_json(force=True)
+    updates = payload.get("updates") or []
+    max_batch = int(os.environ.get("LOCATION_MAX_BATCH", "5000"))
+    if len(updates) > max_batch:
+        return jsonify({"error": f"batch larger than {max_batch} updates"}), 413
+    out = driver_locations.ingest(updates)
+    _maybe_snapshot_locations()
     return jsonify(out)
 
+@app.get("/drivers/nearby")
+def drivers_nearby():
+    lat, lon = float(request.args["lat"]), float(request.args["lon"])
+    radius = float(request.args.get("radius_miles", "5"))
+    max_age = float(os.environ.get("LOCATION_MAX_AGE_S", "900"))
+    rows = driver_locations.nearby(lat, lon, radius, max_age_s=max_age)
+
+    # Only drivers with the requested status (cached reference set); status=any skips the check.
+    status = request.args.get("status", "available")
+    names = {}
+    if status != "any":
+        docs = {d["_id"]: d for d in find_drivers(status, request_partition()).get("docs", [])}
+        rows = [r for r in rows if r[0] in docs]
+        names = {did: d.get("name") for did, d in docs.items()}
+
+    return jsonify({"drivers": [
+        {"driver_id": did, "name": names.get(did), "distance_miles": round(miles, 3), "lat": la, "lon": lo, "ts": ts}
+        for did, miles, la, lo, ts in rows
+    ]})
+
+
+# ----------------------------
+# Batch dispatch
+# ----------------------------
+batcher = BatchScheduler(
+    window_s=float(os.environ.get("BATCH_WINDOW_S", "300")),
+    max_plans=int(os.environ.get("BATCH_MAX_PLANS", "50")),
+)
+
+BATCH_DOC_PREFIX = "batch:"
+
+def _batch_db() -> str:
+    return os.environ.get("CLOUDANT_DB_AUDIT", "resqmeals_audit")
+
+def _persist_batch_entry(entry: dict, scope: str, release_by) -> None:
+    """
+    Store a held donation as a batch:{batch_id} doc so a restart does not lose it.
+    The doc is deleted when the batch is dispatched.
+    """
+    doc = {
+        "_id": BATCH_DOC_PREFIX + entry["batch_id"],
+        "type": "batch_entry",
+        "scope": scope,
+        "release_by": release_by,
+        "queued_at": time.time(),
+        "entry": entry,
+    }
+    try:
+        entry["doc_rev"] = cloudant_put(_batch_db(), doc)["rev"]
+    except Exception as e:
+        print(f"batch entry {entry['batch_id']} not persisted: {e}", flush=True)
+
+def _claim_batch_entries(entries: list) -> list:
+    """
+    Delete the persisted docs of a batch about to be dispatched. An entry whose doc is
+    already gone was claimed by another instance (or a restarted one) and is dropped.
+    """
+    persisted = [e for e in entries if e.get("doc_rev")]
+    if not persisted:
+        return entries
+    docs = [{"_id": BATCH_DOC_PREFIX + e["batch_id"], "_rev": e["doc_rev"], "_deleted": True} for e in persisted]
+    try:
+        results = cloudant_request("POST", f"{_batch_db()}/_bulk_docs", json_body={"docs": docs})
+    except Exception as e:
+        # Dispatching twice is better than not at all.
+        print(f"batch claim failed: {e}", flush=True)
+        return entries
+    lost = {r.get("id") for r in results if r.get("error") in ("conflict", "not_found")}
+    return [e for e in entries if BATCH_DOC_PREFIX + e["batch_id"] not in lost]
+
+def _restore_batch_entries():
+    for doc in cloudant_docs_with_prefix(_batch_db(), BATCH_DOC_PREFIX):
+        if doc.get("type") != "batch_entry":
+            continue
+        entry = {**doc["entry"], "doc_rev": doc["_rev"]}
+        batcher.submit(entry, scope=doc.get("scope") or "*", release_by=doc.get("release_by"), now=doc.get("queued_at"))
+
+def _job_for_batch(plans: list, batch_id: str):
+    for plan in plans:
+        for route in plan["routes"]:
+            if batch_id in route["pickups"]:
+                return route.get("job_id")
+        if batch_id in plan["unassigned"]:
+            return plan["single_jobs"][plan["unassigned"].index(batch_id)]
+    return None
+
+def _batch_entry(payload: dict) -> dict:
+    donation = payload.get("donation") or {}
+    charity = payload.get("charity") or {}
+    reservation = _clean_reservation(payload.get("reservation"))
+    pickup = payload.get("geo") or _restaurant_geo(payload.get("restaurant_id"))
+    return {
+        "restaurant_id": payload.get("restaurant_id"),
+        "pickup_address": payload.get("pickup_address") or donation.get("pickup_address"),
+        "items": payload.get("items"),
+        "deadline": donation.get("pickup_deadline"),
+        "portions": max(1.0, donation_portions(donation)),
+        "pickup": geo_of({"geo": pickup}),
+        "dropoff": geo_of(charity),
+        "charity_id": charity.get("_id") or charity.get("id") or (reservation or {}).get("charity_id"),
+        "charity_name": charity.get("name"),
+        "charity_address": charity.get("address"),
+        "audit_id": payload.get("audit_id"),
+        "reservation": reservation,
+    }
+
+def _solo_job(e: dict) -> dict:
+    job = {
+        "pickup_address": e.get("pickup_address"),
+        "items": e.get("items"),
+        "deadline": e.get("deadline"),
+        "charity": e.get("charity_name"),
+        "restaurant_id": e.get("restaurant_id"),
+        "audit_id": e.get("audit_id"),
+        "reservation": e.get("reservation"),
+        "batch_id": e.get("batch_id"),
+    }
+    if e.get("pickup"):
+        job["geo"] = {"lat": e["pickup"][0], "lon": e["pickup"][1]}
+    return job_board.publish(job, ttl_s=_job_ttl(job))
+
+def _dispatch_batch(scope: str, entries: list) -> dict:
+    """
+    Solve one batch against the available drivers and publish a multi-stop job per route.
+    Donations that fit no route are published as ordinary single jobs.
+    """
+    partition = None if scope == "*" else scope
+    default_cap = float(os.environ.get("BATCH_DEFAULT_CAPACITY", "60"))
+    drivers = []
+    for d in _with_live_positions(find_drivers("available", partition).get("docs", [])):
+        pos = geo_of(d)
+        if pos is not None:
+            drivers.append({"id": d["_id"], "pos": pos, "capacity": vehicle_capacity(d, default_cap)})
+
+    by_id = {e["batch_id"]: e for e in entries}
+    plan = solve(
+        [{"id": e["batch_id"], "pickup": e["pickup"], "dropoff": e["dropoff"],
+          "portions": e["portions"], "deadline": e.get("deadline_ts")} for e in entries],
+        drivers,
+        speed_mph=float(os.environ.get("BATCH_SPEED_MPH", "15")),
+        service_s=float(os.environ.get("BATCH_SERVICE_S", "300")),
+        max_stops=int(os.environ.get("BATCH_MAX_STOPS", "6")),
+        budget_s=float(os.environ.get("BATCH_SOLVE_BUDGET_S", "2")),
+    )
+    plan.update({
+        "plan_id": f"plan_{uuid.uuid4().hex[:8]}",
+        "scope": scope,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "donations": len(entries),
+        "drivers": len(drivers),
+    })
+
+    for route in plan["routes"]:
+        job = {**route_job(route, by_id), "plan_id": plan["plan_id"]}
+        route["job_id"] = job_board.publish(job, ttl_s=_job_ttl(job))["job_id"]
+    plan["single_jobs"] = [_solo_job(by_id[b])["job_id"] for b in plan["unassigned"]]
+    batcher.record(plan)
+    return plan
+
+def _flush(batches: dict) -> list:
+    plans = []
+    for scope, entries in batches.items():
+        entries = _claim_batch_entries(entries)
+        if not entries:
+            continue
+        try:
+            plans.append(_dispatch_batch(scope, entries))
+        except Exception as e:
+            # Never strand held donations: fall back to one job each.
+            print(f"batch dispatch failed for {scope}: {e}", flush=True)
+            for entry in entries:
+                try:
+                    _solo_job(entry)
+                except Exception as e:
+                    print(f"solo dispatch failed for {entry.get('batch_id')}: {e}", flush=True)
+    return plans
+
+def _batch_loop():
+    # Persisted batch: docs are swept into the queue at start-up and then every BATCH_SWEEP_S,
+    # so entries survive a failed first read and a restart of the instance that held them.
+    next_sweep = 0.0
+    while True:
+        try:
+            if time.time() >= next_sweep:
+                try:
+                    _restore_batch_entries()
+                    next_sweep = time.time() + float(os.environ.get("BATCH_SWEEP_S", "300"))
+                except Exception as e:
+                    print(f"batch entry sweep failed: {e}", flush=True)
+                    next_sweep = time.time() + 30
+            nxt = batcher.next_release()
+            wake = next_sweep if nxt is None else min(nxt, next_sweep)
+            batcher.wait(max(0.0, wake - time.time()))
+            _flush(batcher.take_due())
+        except Exception as e:
+            print(f"batch loop error: {e}", flush=True)
+            time.sleep(1)
+
+@app.post("/dispatch/batch/submit")
+@idempotent
+def dispatch_batch_submit():
+    """
+    Queue a reserved donation for batch dispatch.
+    Body: {"restaurant_id", "donation", "charity", "reservation", "audit_id", "pickup_address", "items", "geo"?, "urgent"?}.
+    Held until BATCH_WINDOW_S passes or BATCH_DEADLINE_LEAD_S before its pickup deadline; urgent
+    donations and ones without coordinates are published straight away. Held donations are
+    also stored as batch: docs, which every instance sweeps back into its queue.
+    """
+    payload = request.get_json(force=True)
+    entry = _batch_entry(payload)
+
+    release_by = None
+    window = _pickup_window(entry["deadline"])
+    if window is not None:
+        entry["deadline_ts"] = window[1].timestamp()
+        release_by = entry["deadline_ts"] - float(os.environ.get("BATCH_DEADLINE_LEAD_S", "1800"))
+
+    if entry["pickup"] is None or entry["dropoff"] is None:
+        return jsonify({"queued": False, "job": _solo_job(entry)})
+
+    scope = partition_for_restaurant(entry["restaurant_id"]) if _partitioned() else None
+    entry["batch_id"] = f"bat_{uuid.uuid4().hex[:8]}"
+    urgent = payload.get("urgent") or (release_by is not None and release_by <= time.time())
+    if not urgent:
+        _persist_batch_entry(entry, scope or "*", release_by)
+    entry = batcher.submit(entry, scope=scope or "*", release_by=release_by)
+    if urgent or entry["release_at"] <= time.time():
+        plans = _flush(batcher.take_due(scope=entry["scope"], force=True))
+        job_id = _job_for_batch(plans, entry["batch_id"])
+        return jsonify({"queued": False, "batch_id": entry["batch_id"], "job_id": job_id, "plans": plans})
+    return jsonify({"queued": True, "batch_id": entry["batch_id"], "release_at": entry["release_at"]})
+
+@app.post("/dispatch/batch/flush")
+def dispatch_batch_flush():
+    scope = (request.get_json(silent=True) or {}).get("scope")
+    return jsonify({"plans": _flush(batcher.take_due(force=True, scope=scope))})
+
+@app.get("/dispatch/batch/plans")
+def dispatch_batch_plans():
+    limit = int(request.args.get("limit", "20"))
+    return jsonify({"pending": batcher.pending(), "plans": batcher.recent_plans(limit)})
+
+threading.Thread(target=_batch_loop, name="batch-dispatch", daemon=True).start()
+
+
+# ----------------------------
+# Start-up warm-up
+# ----------------------------
+warmup = Warmup(
+    budget_s=float(os.environ.get("WARMUP_BUDGET_S", "10")),
+    release=os.environ.get("RELEASE_VERSION", os.environ.get("CE_REVISION", "dev")),
+    process_started=_STARTED_AT,
+)
+
+def _warm_charities():
+    # Warm the cache keys dispatch asks for: the unfiltered set plus each WARMUP_ACCEPTS filter
+    # (";"-separated, e.g. the UI's DEFAULT_ACCEPTS), in every city when partitioned.
+    filters = [None] + [f for f in os.environ.get("WARMUP_ACCEPTS", "hot_prepared_food").split(";") if f.strip()]
+    for partition in (list(_city_centroids) if _partitioned() else [None]):
+        for accepts in filters:
+            charity_hours_cache.bitmaps(find_charities(accepts, partition).get("docs", []))
+
+warmup.task("cloudant_token", cloudant_token)
+warmup.task("charities", _warm_charities)
+warmup.task("drivers", find_drivers)
+warmup.task("restaurants", find_restaurants)
+warmup.task("rollups", lambda: rollups.load(_load_rollup_docs()))
+warmup.task("driver_locations", _load_location_snapshot)
+if os.environ.get("WARMUP_LLM_PING", "0") == "1":
+    warmup.task("llm_ping", lambda: call_llm("Reply with OK.", "ping", max_tokens=1))
+
+if os.environ.get("WARMUP_ENABLED", "1") != "1":
+    warmup.tasks.clear()
+warmup.start()
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", "8080"))
@@ -0,0 +1,192 @@
+import io
+import json
+
+# Flat row layout for audit exports: one row per donated food item, with the
+# dispatch context repeated on each row. Audits without items produce one row.
+EXPORT_COLUMNS = [
+    ("audit_id", "string"),
+    ("created_at", "string"),
+    ("restaurant_id", "string"),
+    ("status", "string"),
+    ("item_index", "int"),
+    ("item_name", "string"),
+    ("item_quantity", "float"),
+    ("item_unit", "string"),
+    ("pickup_deadline", "string"),
+    ("pickup_address", "string"),
+    ("charity_id", "string"),
+    ("charity_name", "string"),
+    ("driver_id", "string"),
+    ("driver_name", "string"),
+    ("driver_rating", "float"),
+    ("receipt_id", "string"),
+    ("receipt_timestamp", "string"),
+]
+
+EXPORT_FIELDS = [
+    "_id", "created_at", "restaurant_id", "status",
+    "extracted", "selected_charity", "selected_driver", "receipt",
+]
+
+
+def _as_obj(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except Exception:
+            return {}
+    return value if isinstance(value, dict) else {}
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_str(value):
+    return None if value is None else str(value)
+
+
+def flatten_audit_doc(doc: dict) -> list:
+    extracted = _as_obj(doc.get("extracted"))
+    charity = _as_obj(doc.get("selected_charity"))
+    driver = _as_obj(doc.get("selected_driver"))
+    receipt = _as_obj(doc.get("receipt"))
+
+    base = {
+        "audit_id": doc.get("_id"),
+        "created_at": doc.get("created_at"),
+        "restaurant_id": _as_str(doc.get("restaurant_id")),
+        "status": _as_str(doc.get("status")),
+        "pickup_deadline": _as_str(extracted.get("pickup_deadline")),
+        "pickup_address": _as_str(extracted.get("pickup_address")),
+        "charity_id": _as_str(charity.get("_id") or charity.get("id")),
+        "charity_name": _as_str(charity.get("name")),
+        "driver_id": _as_str(driver.get("_id") or driver.get("id")),
+        "driver_name": _as_str(driver.get("name")),
+        "driver_rating": _as_float(driver.get("rating")),
+        "receipt_id": _as_str(receipt.get("receipt_id")),
+        "receipt_timestamp": _as_str(receipt.get("timestamp")),
+    }
+
+    items = [it for it in (extracted.get("food_items") or []) if isinstance(it, dict)]
+    if not items:
+        return [{**base, "item_index": None, "item_name": None, "item_quantity": None, "item_unit": None}]
+
+    return [
+        {
+            **base,
+            "item_index": i,
+            "item_name": _as_str(it.get("name")),
+            "item_quantity": _as_float(it.get("quantity")),
+            "item_unit": _as_str(it.get("unit")),
+        }
+        for i, it in enumerate(items)
+    ]
+
+
+def audit_selector(since=None, until=None, restaurant_id=None) -> dict:
+    sel = {"type": "audit"}
+    if since or until:
+        rng = {}
+        if since:
+            rng["$gte"] = since
+        if until:
+            rng["$lt"] = until
+        sel["created_at"] = rng
+    if restaurant_id:
+        sel["restaurant_id"] = restaurant_id
+    return sel
+
+
+def iter_pages(find, db: str, selector: dict, page_size: int, fields=None):
+    """
+    Walk a Cloudant _find result set with bookmarks, yielding one list of docs per page.
+    """
+    bookmark = None
+    while True:
+        out = find(db, selector, limit=page_size, fields=fields, bookmark=bookmark)
+        docs = out.get("docs", [])
+        if docs:
+            yield docs
+        bookmark = out.get("bookmark")
+        if len(docs) < page_size or not bookmark:
+            return
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object that hands written bytes back to the caller on drain().
+    Lets the Arrow and Parquet writers stream through a Flask response generator.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _arrow_schema(pa):
+    types = {"string": pa.string(), "int": pa.int32(), "float": pa.float64()}
+    return pa.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS])
+
+
+def stream_ndjson(pages):
+    for docs in pages:
+        lines = []
+        for doc in docs:
+            for row in flatten_audit_doc(doc):
+                ordered = {name: row[name] for name, _ in EXPORT_COLUMNS}
+                lines.append(json.dumps(ordered, ensure_ascii=False))
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def stream_arrow(pages, fmt: str):
+    """
+    Stream Arrow IPC ("arrow") or Parquet ("parquet"), one record batch / row group per page.
+    """
+    import pyarrow as pa
+
+    schema = _arrow_schema(pa)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = writer.write_table
+        to_chunk = lambda cols: pa.Table.from_pydict(cols, schema=schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+        to_chunk = lambda cols: pa.RecordBatch.from_pydict(cols, schema=schema)
+
+    for docs in pages:
+        rows = [row for doc in docs for row in flatten_audit_doc(doc)]
+        if not rows:
+            continue
+        write(to_chunk({name: [r[name] for r in rows] for name, _ in EXPORT_COLUMNS}))
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+
+    writer.close()
+    tail = sink.drain()
+    if tail:
+        yield tail
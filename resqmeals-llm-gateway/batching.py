@@ -0,0 +1,376 @@
+import threading
+import time
+import uuid
+from collections import deque
+
+from geo import haversine_miles
+
+INF = float("inf")
+
+VEHICLE_CAPACITY = {"bike": 15, "bicycle": 15, "cargo_bike": 40, "scooter": 20, "car": 60, "van": 200}
+
+
+def vehicle_capacity(driver: dict, default: float = 60) -> float:
+    """
+    Portions a driver can carry: "capacity_portions" on the doc or its vehicle, else by vehicle type.
+    """
+    if driver.get("capacity_portions") is not None:
+        return float(driver["capacity_portions"])
+    vehicle = driver.get("vehicle")
+    if isinstance(vehicle, dict):
+        if vehicle.get("capacity_portions") is not None:
+            return float(vehicle["capacity_portions"])
+        vehicle = vehicle.get("type")
+    return float(VEHICLE_CAPACITY.get(str(vehicle or "").lower(), default))
+
+
+# ----------------------------
+# Route planning
+# ----------------------------
+class _Problem:
+    """
+    Distance matrix and route evaluation for one batch.
+
+    Points are laid out as [drivers..., pickups..., dropoffs...]. A route is one driver's
+    ordered list of donations: the driver visits every pickup in that order, then drops
+    at the charities (nearest next). Pickups must be reached before each donation's deadline.
+    """
+
+    def __init__(self, donations, drivers, now, speed_mph, service_s, max_stops):
+        self.n, self.k = len(donations), len(drivers)
+        self.p0, self.q0 = self.k, self.k + self.n
+        pts = [d["pos"] for d in drivers] + [x["pickup"] for x in donations] + [x["dropoff"] for x in donations]
+        self.dist = [[0.0] * len(pts) for _ in pts]
+        for a in range(len(pts)):
+            for b in range(max(a + 1, self.k), len(pts)):
+                d = haversine_miles(pts[a][0], pts[a][1], pts[b][0], pts[b][1])
+                self.dist[a][b] = self.dist[b][a] = d
+
+        self.portions = [float(x.get("portions") or 0) for x in donations]
+        self.deadline = [x.get("deadline") for x in donations]
+        self.capacity = [float(d.get("capacity") or INF) for d in drivers]
+        self.now = now
+        self.secs_per_mile = 3600.0 / speed_mph
+        self.service_s = service_s
+        self.max_stops = max_stops
+        self._memo = {}
+
+    def walk(self, k: int, seq: tuple):
+        """
+        (miles, drop order, pickup ETAs) for driver k doing `seq`, or None if infeasible.
+        """
+        if not seq:
+            return 0.0, (), ()
+        if len(seq) > self.max_stops or sum(self.portions[i] for i in seq) > self.capacity[k]:
+            return None
+        dist = self.dist
+        pos, t, miles, etas = k, self.now, 0.0, []
+        for i in seq:
+            p = self.p0 + i
+            leg = dist[pos][p]
+            miles += leg
+            t += leg * self.secs_per_mile
+            if self.deadline[i] is not None and t > self.deadline[i]:
+                return None
+            etas.append(t)
+            t += self.service_s
+            pos = p
+
+        left, drops = list(seq), []
+        while left:
+            i = min(left, key=lambda j: dist[pos][self.q0 + j])
+            miles += dist[pos][self.q0 + i]
+            pos = self.q0 + i
+            left.remove(i)
+            drops.append(i)
+        return miles, tuple(drops), tuple(etas)
+
+    def cost(self, k: int, seq) -> float:
+        key = (k, tuple(seq))
+        hit = self._memo.get(key)
+        if hit is None:
+            w = self.walk(k, key[1])
+            hit = self._memo[key] = INF if w is None else w[0]
+        return hit
+
+    def solo_miles(self, i: int) -> float:
+        """
+        One-by-one dispatch baseline: nearest driver to the pickup, then straight to the charity.
+        """
+        p, q = self.p0 + i, self.q0 + i
+        reach = min((self.dist[k][p] for k in range(self.k)), default=0.0)
+        return reach + self.dist[p][q]
+
+
+def _best_insertion(prob: _Problem, routes: list, costs: list, i: int, candidates):
+    best = (INF, None, None)
+    for k in candidates:
+        seq = routes[k]
+        for pos in range(len(seq) + 1):
+            delta = prob.cost(k, seq[:pos] + [i] + seq[pos:]) - costs[k]
+            if delta < best[0]:
+                best = (delta, k, pos)
+    return best
+
+
+def solve(
+    donations: list,
+    drivers: list,
+    now: float = None,
+    speed_mph: float = 15.0,
+    service_s: float = 300.0,
+    max_stops: int = 6,
+    neighbors: int = 8,
+    budget_s: float = 2.0,
+) -> dict:
+    """
+    Capacitated multi-stop routing for one batch.
+
+    donations: [{"id", "pickup": (lat, lon), "dropoff": (lat, lon), "portions", "deadline": epoch or None}]
+    drivers:   [{"id", "pos": (lat, lon), "capacity"}]
+
+    Cheapest insertion in deadline order builds the first plan. Local search then applies
+    relocate, swap and 2-opt moves until nothing improves or `budget_s` runs out. Moves are
+    only tried against routes of the `neighbors` nearest pickups and drivers, which keeps
+    each pass close to linear in the batch size.
+    """
+    started = time.perf_counter()
+    now = now if now is not None else time.time()
+    prob = _Problem(donations, drivers, now, speed_mph, service_s, max_stops)
+    n, k = prob.n, prob.k
+    p0 = prob.p0
+
+    near_pickups = [
+        sorted((j for j in range(n) if j != i), key=lambda j: prob.dist[p0 + i][p0 + j])[:neighbors]
+        for i in range(n)
+    ]
+    near_drivers = [sorted(range(k), key=lambda d: prob.dist[d][p0 + i])[:neighbors] for i in range(n)]
+
+    routes = [[] for _ in range(k)]
+    costs = [0.0] * k
+    where = [None] * n
+
+    def candidates(i):
+        out = set(near_drivers[i])
+        out.update(where[j] for j in near_pickups[i] if where[j] is not None)
+        return out
+
+    def place(i, r, pos):
+        routes[r].insert(pos, i)
+        costs[r] = prob.cost(r, routes[r])
+        where[i] = r
+
+    order = sorted(range(n), key=lambda i: (prob.deadline[i] is None, prob.deadline[i] or 0, -prob.portions[i]))
+    for i in order:
+        delta, r, pos = _best_insertion(prob, routes, costs, i, candidates(i))
+        if r is None:
+            delta, r, pos = _best_insertion(prob, routes, costs, i, range(k))
+        if r is not None:
+            place(i, r, pos)
+
+    iterations = 0
+    improved = True
+    while improved and time.perf_counter() - started < budget_s:
+        improved = False
+        iterations += 1
+
+        # Relocate one donation into another route (or first-time insert an unassigned one).
+        for i in range(n):
+            src = where[i]
+            if src is not None:
+                rest = [j for j in routes[src] if j != i]
+                gain = costs[src] - prob.cost(src, rest)
+            else:
+                rest, gain = None, INF
+            delta, r, pos = _best_insertion(prob, routes, costs, i, candidates(i) - {src})
+            if r is not None and delta < gain - 1e-9:
+                if src is not None:
+                    routes[src] = rest
+                    costs[src] = prob.cost(src, rest)
+                place(i, r, pos)
+                improved = True
+
+        # Swap two donations between routes, each taking the other's position.
+        for i in range(n):
+            for j in near_pickups[i]:
+                a, b = where[i], where[j]
+                if a is None or b is None or a == b:
+                    continue
+                ra = [j if x == i else x for x in routes[a]]
+                rb = [i if x == j else x for x in routes[b]]
+                ca, cb = prob.cost(a, ra), prob.cost(b, rb)
+                if ca + cb < costs[a] + costs[b] - 1e-9:
+                    routes[a], routes[b], costs[a], costs[b] = ra, rb, ca, cb
+                    where[i], where[j] = b, a
+                    improved = True
+
+        # 2-opt: reverse a stretch of pickups within one route.
+        for r in range(k):
+            seq = routes[r]
+            for s in range(len(seq) - 1):
+                for e in range(s + 1, len(seq)):
+                    cand = seq[:s] + seq[s:e + 1][::-1] + seq[e + 1:]
+                    c = prob.cost(r, cand)
+                    if c < costs[r] - 1e-9:
+                        seq, costs[r] = cand, c
+                        improved = True
+            routes[r] = seq
+
+    out_routes = []
+    for r in range(k):
+        if not routes[r]:
+            continue
+        miles, drops, etas = prob.walk(r, tuple(routes[r]))
+        out_routes.append({
+            "driver_id": drivers[r]["id"],
+            "pickups": [donations[i]["id"] for i in routes[r]],
+            "dropoffs": [donations[i]["id"] for i in drops],
+            "pickup_etas": [round(t) for t in etas],
+            "portions": sum(prob.portions[i] for i in routes[r]),
+            "capacity": drivers[r].get("capacity"),
+            "miles": round(miles, 2),
+        })
+
+    unassigned = [donations[i]["id"] for i in range(n) if where[i] is None]
+    batched = sum(costs) + sum(prob.solo_miles(i) for i in range(n) if where[i] is None)
+    solo = sum(prob.solo_miles(i) for i in range(n))
+    return {
+        "routes": out_routes,
+        "unassigned": unassigned,
+        "batched_miles": round(batched, 2),
+        "solo_miles": round(solo, 2),
+        "saved_miles": round(solo - batched, 2),
+        "iterations": iterations,
+        "solve_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def route_job(route: dict, entries: dict) -> dict:
+    """
+    Multi-stop job for the job board from a solved route and the queued entries it covers.
+    """
+    pickups = [entries[b] for b in route["pickups"]]
+    stops = [
+        {
+            "kind": "pickup",
+            "batch_id": e["batch_id"],
+            "restaurant_id": e.get("restaurant_id"),
+            "address": e.get("pickup_address"),
+            "items": e.get("items"),
+            "deadline": e.get("deadline"),
+            "portions": e.get("portions"),
+            "geo": {"lat": e["pickup"][0], "lon": e["pickup"][1]},
+        }
+        for e in pickups
+    ]
+    for b in route["dropoffs"]:
+        e = entries[b]
+        last = stops[-1]
+        if last["kind"] == "dropoff" and last["charity_id"] == e.get("charity_id"):
+            last["batch_ids"].append(e["batch_id"])
+            continue
+        stops.append({
+            "kind": "dropoff",
+            "batch_ids": [e["batch_id"]],
+            "charity_id": e.get("charity_id"),
+            "charity": e.get("charity_name"),
+            "address": e.get("charity_address"),
+            "geo": {"lat": e["dropoff"][0], "lon": e["dropoff"][1]},
+        })
+
+    first = pickups[0]
+    return {
+        "pickup_address": first.get("pickup_address"),
+        "items": "; ".join(e.get("items") or "" for e in pickups),
+        "deadline": first.get("deadline"),
+        "charity": ", ".join(dict.fromkeys(e.get("charity_name") or "" for e in pickups)),
+        "restaurant_id": first.get("restaurant_id"),
+        "geo": {"lat": first["pickup"][0], "lon": first["pickup"][1]},
+        "stops": stops,
+        "audit_ids": [e.get("audit_id") for e in pickups if e.get("audit_id")],
+        "reservations": [e["reservation"] for e in pickups if e.get("reservation")],
+        "suggested_driver": route.get("driver_id"),
+        "distance_miles": route.get("miles"),
+    }
+
+
+# ----------------------------
+# Batch window
+# ----------------------------
+class BatchScheduler:
+    """
+    Holds non-urgent donations so nearby pickups can share a driver.
+
+    Each entry is released after `window_s`, or earlier at its `release_by` time (derived
+    from the pickup deadline), whichever comes first. When any entry in a scope (a city,
+    or "*") is due, the whole scope is handed out as one batch, since waiting longer would
+    not help the donations already due.
+    """
+
+    def __init__(self, window_s: float = 300, max_plans: int = 50):
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self.plans = deque(maxlen=max_plans)
+
+    def submit(self, entry: dict, scope: str = "*", release_by=None, now=None) -> dict:
+        """
+        Hold an entry; `now` is its queue time. A batch_id that is already held is not queued twice.
+        """
+        now = now if now is not None else time.time()
+        release_at = now + self.window_s
+        if release_by is not None:
+            release_at = min(release_at, release_by)
+        entry = {
+            **entry,
+            "batch_id": entry.get("batch_id") or f"bat_{uuid.uuid4().hex[:8]}",
+            "scope": scope,
+            "queued_at": now,
+            "release_at": release_at,
+        }
+        with self._lock:
+            for held in self._pending.get(scope, []):
+                if held["batch_id"] == entry["batch_id"]:
+                    return held
+            self._pending.setdefault(scope, []).append(entry)
+        self._wake.set()
+        return entry
+
+    def next_release(self):
+        with self._lock:
+            return min((e["release_at"] for es in self._pending.values() for e in es), default=None)
+
+    def take_due(self, now=None, force: bool = False, scope=None) -> dict:
+        """
+        Pop every scope with a due entry (or every scope, or just `scope`, when forced): {scope: [entries]}.
+        """
+        now = now if now is not None else time.time()
+        out = {}
+        with self._lock:
+            for s in list(self._pending):
+                if scope is not None and s != scope:
+                    continue
+                entries = self._pending[s]
+                if force or any(e["release_at"] <= now for e in entries):
+                    out[s] = self._pending.pop(s)
+        return out
+
+    def wait(self, timeout=None) -> None:
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    def pending(self) -> list:
+        with self._lock:
+            return [
+                {k: e.get(k) for k in ("batch_id", "scope", "restaurant_id", "portions", "queued_at", "release_at")}
+                for es in self._pending.values() for e in es
+            ]
+
+    def record(self, plan: dict) -> None:
+        with self._lock:
+            self.plans.appendleft(plan)
+
+    def recent_plans(self, limit: int = 20) -> list:
+        with self._lock:
+            return list(self.plans)[:limit]
@@ -0,0 +1,82 @@
+"""
+Batch dispatcher benchmark on synthetic cities.
+
+For each batch size, places restaurants, charities and available drivers across a city
+(about one driver per three donations, mixed bikes, cars and vans), gives every donation
+a pickup deadline 45-180 minutes out, and solves the batch with batching.solve. Reports
+solve time and the total distance of the batched plan against one-by-one dispatch, where
+each donation gets its own trip from the nearest driver to the restaurant and then to
+the charity.
+
+    python benchmarks/bench_batching.py --sizes 5,10,20,50,100,200 --trials 5
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from batching import VEHICLE_CAPACITY, solve  # noqa: E402
+
+CENTER = (59.91, 10.75)
+
+
+def point(rng: random.Random, spread: float):
+    return CENTER[0] + rng.gauss(0, spread), CENTER[1] + rng.gauss(0, spread * 1.8)
+
+
+def make_batch(n: int, rng: random.Random, now: float, spread: float):
+    charities = [point(rng, spread) for _ in range(max(3, n // 5))]
+    restaurants = [point(rng, spread) for _ in range(max(2, int(n * 0.8)))]
+    donations = [
+        {
+            "id": f"d{i}",
+            "pickup": rng.choice(restaurants),
+            "dropoff": rng.choice(charities),
+            "portions": rng.randint(5, 40),
+            "deadline": now + rng.uniform(45, 180) * 60,
+        }
+        for i in range(n)
+    ]
+    vehicles = ["bike", "car", "car", "car", "van"]
+    drivers = []
+    for j in range(max(2, n // 3)):
+        v = rng.choice(vehicles)
+        drivers.append({"id": f"v{j}", "pos": point(rng, spread), "capacity": VEHICLE_CAPACITY[v]})
+    return donations, drivers
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="5,10,20,50,100,200")
+    ap.add_argument("--trials", type=int, default=5)
+    ap.add_argument("--spread", type=float, default=0.03, help="city radius in degrees (stddev)")
+    ap.add_argument("--budget", type=float, default=2.0, help="local search time budget per solve (s)")
+    ap.add_argument("--seed", type=int, default=11)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'batch':>6} {'solve ms':>10} {'p max ms':>9} {'routes':>7} {'unassigned':>10} "
+          f"{'solo mi':>9} {'batched mi':>11} {'saved':>7}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        times, routes, unassigned, solo, batched = [], [], [], [], []
+        for _ in range(args.trials):
+            now = time.time()
+            donations, drivers = make_batch(size, rng, now, args.spread)
+            plan = solve(donations, drivers, now=now, budget_s=args.budget)
+            times.append(plan["solve_ms"])
+            routes.append(len(plan["routes"]))
+            unassigned.append(len(plan["unassigned"]))
+            solo.append(plan["solo_miles"])
+            batched.append(plan["batched_miles"])
+        saved = 1 - sum(batched) / sum(solo)
+        print(f"{size:>6} {statistics.mean(times):>10.1f} {max(times):>9.1f} {statistics.mean(routes):>7.1f} "
+              f"{statistics.mean(unassigned):>10.1f} {statistics.mean(solo):>9.1f} "
+              f"{statistics.mean(batched):>11.1f} {saved:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
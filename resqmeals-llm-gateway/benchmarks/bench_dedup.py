@@ -0,0 +1,127 @@
+"""
+Near-duplicate detector benchmark on a synthetic corpus.
+
+Generates N donation messages from 500 restaurants over 48 hours, re-posts about 10% of
+them with reworded text a few minutes later, and streams everything through
+NearDuplicateIndex.check_and_add in time order. Reports per-message latency and
+precision/recall against the injected duplicates.
+
+    python benchmarks/bench_dedup.py --messages 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dedup import NearDuplicateIndex  # noqa: E402
+
+ITEMS = ["biryani", "pasta", "pizza", "sandwiches", "salad", "soup", "bread rolls", "curry",
+         "rice", "noodles", "bagels", "muffins", "lasagna", "falafel wraps", "sushi", "tacos",
+         "baked beans", "yoghurt", "fruit boxes", "croissants"]
+UNITS = ["portions", "trays", "boxes", "cans", "kg", "bags", "plates"]
+STREETS = ["Park Street", "High Road", "Hagalokkveien", "LP Wettres vei", "Market Lane",
+           "Church Road", "Station Avenue", "Mill Street", "King's Way", "Harbour Road"]
+OPENERS = ["We have", "I have", "Got", "There are", "We've got", "Available:"]
+TAILS = ["to be picked up", "can be collected", "for pickup", "ready for collection"]
+WHEN = ["after {h}pm", "before {h}pm", "by {h} PM", "at {h}pm", "between {h} and {h2}pm"]
+REWORD = [("We have", "we've got"), ("I have", "i've got"), ("picked up", "collected"),
+          ("portions", "servings"), ("leftover", "left over"), (" from ", " at ")]
+
+
+def make_message(rng: random.Random) -> str:
+    h = rng.randint(1, 9)
+    when = rng.choice(WHEN).format(h=h, h2=h + 2)
+    parts = [
+        rng.choice(OPENERS),
+        str(rng.randint(2, 60)),
+        rng.choice(UNITS),
+        "of",
+        rng.choice(["", "leftover ", "fresh ", "surplus "]) + rng.choice(ITEMS),
+    ]
+    if rng.random() < 0.5:
+        parts += ["and", str(rng.randint(2, 30)), rng.choice(UNITS), "of", rng.choice(ITEMS)]
+    parts += [rng.choice(TAILS), when, "from", f"{rng.choice(STREETS)} {rng.randint(1, 200)}"]
+    return " ".join(parts)
+
+
+def reword(rng: random.Random, text: str) -> str:
+    for a, b in rng.sample(REWORD, 2):
+        text = text.replace(a, b)
+    if rng.random() < 0.5:
+        text = text.upper() if rng.random() < 0.2 else text + rng.choice([" thanks!", " pls", " - asap", "."])
+    return text
+
+
+def build_corpus(n: int, dup_rate: float, seed: int):
+    rng = random.Random(seed)
+    restaurants = [f"restaurant:{i}" for i in range(500)]
+    span = 48 * 3600
+    events = []
+    i = 0
+    while len(events) < n:
+        ts = rng.uniform(0, span)
+        rid = rng.choice(restaurants)
+        text = make_message(rng)
+        events.append((ts, rid, text, None, i))
+        if len(events) < n and rng.random() < dup_rate:
+            events.append((ts + rng.uniform(30, 1800), rid, reword(rng, text), i, None))
+        i += 1
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=100_000)
+    ap.add_argument("--dup-rate", type=float, default=0.1)
+    ap.add_argument("--threshold", type=float, default=0.6)
+    ap.add_argument("--window-s", type=float, default=7200)
+    ap.add_argument("--num-perm", type=int, default=64)
+    ap.add_argument("--bands", type=int, default=16)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    events = build_corpus(args.messages, args.dup_rate, args.seed)
+    idx = NearDuplicateIndex(threshold=args.threshold, window_s=args.window_s,
+                             num_perm=args.num_perm, bands=args.bands)
+
+    msg_of_original = {}
+    latencies = []
+    tp = fp = fn = 0
+    started = time.perf_counter()
+    for ts, rid, text, dup_of, orig in events:
+        t0 = time.perf_counter()
+        match, mid = idx.check_and_add(text, rid, now=ts)
+        latencies.append(time.perf_counter() - t0)
+
+        if orig is not None:
+            msg_of_original[orig] = mid
+        expected = msg_of_original.get(dup_of) if dup_of is not None else None
+        if match and expected is not None and match["message_id"] == expected:
+            tp += 1
+        elif match:
+            fp += 1
+        elif expected is not None:
+            fn += 1
+    total = time.perf_counter() - started
+
+    latencies.sort()
+    injected = sum(1 for e in events if e[3] is not None)
+    print(f"messages           {len(events):,} ({injected:,} injected near-duplicates)")
+    print(f"params             threshold={args.threshold} window={args.window_s:.0f}s "
+          f"num_perm={args.num_perm} bands={args.bands}")
+    print(f"total              {total:.2f}s  ({len(events) / total:,.0f} msg/s)")
+    print(f"latency mean       {statistics.mean(latencies) * 1e3:.3f} ms")
+    print(f"latency p50/p99    {latencies[len(latencies) // 2] * 1e3:.3f} / "
+          f"{latencies[int(len(latencies) * 0.99)] * 1e3:.3f} ms")
+    print(f"precision          {tp / max(1, tp + fp):.3f}  (tp={tp}, fp={fp})")
+    print(f"recall             {tp / max(1, tp + fn):.3f}  (fn={fn})")
+    print(f"entries in window  {len(idx):,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Driver location ingestion benchmark.
+
+Simulates a fleet of drivers moving around a city and pinging every few seconds. The
+pings are batched the way the driver app sends them. Measures:
+
+  * LocationStore.ingest throughput (updates/s) for the in-memory store alone
+  * end-to-end POST /drivers/locations throughput through the Flask test client
+  * GET /drivers/nearby style radius-lookup latency against the populated grid
+
+    python benchmarks/bench_locations.py --drivers 5000 --rounds 20 --batch 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from locations import LocationStore  # noqa: E402
+
+CENTER = (59.91, 10.75)
+SPREAD_DEG = 0.25
+
+
+def make_rounds(drivers: int, rounds: int, seed: int):
+    """
+    One list of [driver_id, lat, lon, ts] per ping round; each driver drifts a little per round.
+    """
+    rng = random.Random(seed)
+    pos = [[CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG), CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)]
+           for _ in range(drivers)]
+    t0 = time.time() - rounds * 5
+    out = []
+    for r in range(rounds):
+        batch = []
+        for i, p in enumerate(pos):
+            p[0] += rng.gauss(0, 0.0005)
+            p[1] += rng.gauss(0, 0.0008)
+            batch.append([f"driver:{i}", round(p[0], 6), round(p[1], 6), t0 + r * 5 + rng.random()])
+        out.append(batch)
+    return out
+
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bench_store(rounds: list, batch: int) -> LocationStore:
+    store = LocationStore()
+    total = sum(len(r) for r in rounds)
+    started = time.perf_counter()
+    for r in rounds:
+        for b in chunks(r, batch):
+            store.ingest(b)
+    elapsed = time.perf_counter() - started
+    print(f"store ingest     {total:>9,} updates in {elapsed:6.2f}s  {total / elapsed:>10,.0f} updates/s")
+    return store
+
+
+def bench_http(rounds: list, batch: int) -> None:
+    os.environ.setdefault("WARMUP_ENABLED", "0")
+    os.environ.setdefault("LOCATION_SNAPSHOT_S", "1e9")
+    import app as gateway
+
+    client = gateway.app.test_client()
+    total = sum(len(r) for r in rounds)
+    latencies = []
+    started = time.perf_counter()
+    for r in rounds:
+        for b in chunks(r, batch):
+            t = time.perf_counter()
+            resp = client.post("/drivers/locations", json={"updates": b})
+            latencies.append((time.perf_counter() - t) * 1000)
+            assert resp.status_code == 200, resp.data
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(
+        f"http ingest      {total:>9,} updates in {elapsed:6.2f}s  {total / elapsed:>10,.0f} updates/s  "
+        f"({len(latencies)} requests, p50 {latencies[len(latencies) // 2]:.1f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms)"
+    )
+
+
+def bench_nearby(store: LocationStore, queries: int, radius: float, seed: int) -> None:
+    rng = random.Random(seed)
+    latencies, hits = [], []
+    for _ in range(queries):
+        lat = CENTER[0] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        lon = CENTER[1] + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+        t = time.perf_counter()
+        rows = store.nearby(lat, lon, radius)
+        latencies.append((time.perf_counter() - t) * 1000)
+        hits.append(len(rows))
+    latencies.sort()
+    print(
+        f"nearby {radius:g} mi    {queries:>9,} queries  mean {statistics.mean(latencies):.3f} ms  "
+        f"p99 {latencies[int(queries * 0.99)]:.3f} ms  ({statistics.mean(hits):.0f} drivers per answer)"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drivers", type=int, default=5000)
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--skip-http", action="store_true")
+    args = ap.parse_args()
+
+    rounds = make_rounds(args.drivers, args.rounds, args.seed)
+    store = bench_store(rounds, args.batch)
+    if not args.skip_http:
+        bench_http(rounds, args.batch)
+    for radius in (1.0, 3.0, 5.0):
+        bench_nearby(store, args.queries, radius, args.seed)
+
+
+if __name__ == "__main__":
+    main()
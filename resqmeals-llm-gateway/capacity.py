@@ -0,0 +1,165 @@
+import threading
+import time
+import uuid
+
+
+class CapacityError(RuntimeError):
+    pass
+
+
+def capacity_of(charity: dict) -> dict:
+    """
+    Structured capacity from a charity doc:
+    {"daily_portions": 120, "categories": {"hot_prepared_food": 40}}. Missing limits mean unlimited.
+    """
+    cap = (charity or {}).get("capacity") or {}
+    return cap if isinstance(cap, dict) else {}
+
+
+def ledger_doc_id(charity_id: str, day: str) -> str:
+    return f"capacity:{charity_id}:{day}"
+
+
+def _live(holds: dict, now: float) -> dict:
+    return {
+        rid: h for rid, h in holds.items()
+        if h.get("status") == "confirmed" or (h.get("expires") or 0) > now
+    }
+
+
+def usage(holds: dict, now: float) -> dict:
+    out = {"portions": 0.0, "categories": {}}
+    for h in _live(holds, now).values():
+        out["portions"] += h.get("portions", 0)
+        cat = h.get("category")
+        if cat:
+            out["categories"][cat] = out["categories"].get(cat, 0) + h.get("portions", 0)
+    return out
+
+
+def would_exceed(holds: dict, cap: dict, portions: float, category, now: float) -> bool:
+    used = usage(holds, now)
+    daily = cap.get("daily_portions")
+    if daily is not None and used["portions"] + portions > float(daily):
+        return True
+    limit = (cap.get("categories") or {}).get(category) if category else None
+    if limit is not None and used["categories"].get(category, 0) + portions > float(limit):
+        return True
+    return False
+
+
+class CapacityLedger:
+    """
+    Per-charity, per-day portion reservations.
+
+    Cloudant holds one ledger doc per charity per day with every hold in it; writes use
+    optimistic concurrency on _rev so concurrent dispatches (across instances) cannot
+    over-assign. This class keeps the last known holds in memory so ranking can skip
+    saturated charities without a database round trip. Holds carry an expiry and stop
+    counting once it passes, so an abandoned dispatch releases its capacity by itself.
+    """
+
+    def __init__(self, default_ttl_s: int = 3600):
+        self.default_ttl_s = default_ttl_s
+        self._lock = threading.Lock()
+        self._ledgers = {}
+
+    def is_saturated(self, charity: dict, day: str, portions: float = 0.0, category=None) -> bool:
+        cap = capacity_of(charity)
+        if not cap:
+            return False
+        with self._lock:
+            holds = self._ledgers.get((charity.get("_id"), day), {})
+            return would_exceed(holds, cap, max(portions, 1e-9), category, time.time())
+
+    def status(self, charity: dict, day: str) -> dict:
+        cap = capacity_of(charity)
+        with self._lock:
+            used = usage(self._ledgers.get((charity.get("_id"), day), {}), time.time())
+        daily = cap.get("daily_portions")
+        return {
+            "charity_id": charity.get("_id"),
+            "day": day,
+            "capacity": cap,
+            "used": used,
+            "remaining_portions": None if daily is None else max(0.0, float(daily) - used["portions"]),
+        }
+
+    def reserve(self, charity: dict, day: str, portions: float, load_fn, save_fn,
+                category=None, ttl_s=None, attempts: int = 5) -> dict:
+        """
+        Reserve portions at a charity for `day`.
+
+        load_fn(doc_id) returns the ledger doc (or {}); save_fn(doc) returns False on a
+        _rev conflict. Raises CapacityError when the charity has no room left.
+        """
+        charity_id = charity.get("_id")
+        cap = capacity_of(charity)
+        key = (charity_id, day)
+        now = time.time()
+        rid = f"res_{uuid.uuid4().hex[:12]}"
+        hold = {
+            "portions": float(portions),
+            "category": category,
+            "status": "held",
+            "expires": now + int(ttl_s if ttl_s is not None else self.default_ttl_s),
+        }
+
+        # Fast reject from the in-memory ledger, then hold the slot locally while persisting.
+        with self._lock:
+            if key not in self._ledgers:
+                self._ledgers = {k: v for k, v in self._ledgers.items() if k[1] >= day}
+            holds = self._ledgers.setdefault(key, {})
+            if would_exceed(holds, cap, hold["portions"], category, now):
+                raise CapacityError(f"{charity_id} is at capacity for {day}")
+            holds[rid] = hold
+
+        try:
+            for _ in range(attempts):
+                doc = load_fn(ledger_doc_id(charity_id, day)) or {}
+                persisted = _live(doc.get("holds") or {}, time.time())
+                if would_exceed(persisted, cap, hold["portions"], category, time.time()):
+                    raise CapacityError(f"{charity_id} is at capacity for {day}")
+                persisted[rid] = hold
+                doc.update({
+                    "_id": ledger_doc_id(charity_id, day),
+                    "type": "capacity_ledger",
+                    "charity_id": charity_id,
+                    "day": day,
+                    "holds": persisted,
+                })
+                if save_fn(doc):
+                    with self._lock:
+                        self._ledgers[key] = dict(persisted)
+                    return {"reservation_id": rid, "charity_id": charity_id, "day": day, **hold}
+            raise CapacityError(f"{charity_id}: too many concurrent reservations, retry")
+        except Exception:
+            with self._lock:
+                self._ledgers.get(key, {}).pop(rid, None)
+            raise
+
+    def release(self, charity_id: str, day: str, reservation_id: str, load_fn, save_fn) -> bool:
+        return self._update_hold(charity_id, day, reservation_id, None, load_fn, save_fn)
+
+    def confirm(self, charity_id: str, day: str, reservation_id: str, load_fn, save_fn) -> bool:
+        return self._update_hold(charity_id, day, reservation_id, "confirmed", load_fn, save_fn)
+
+    def _update_hold(self, charity_id, day, reservation_id, status, load_fn, save_fn, attempts: int = 5) -> bool:
+        key = (charity_id, day)
+        for _ in range(attempts):
+            doc = load_fn(ledger_doc_id(charity_id, day)) or {}
+            holds = _live(doc.get("holds") or {}, time.time())
+            if reservation_id not in holds:
+                with self._lock:
+                    self._ledgers[key] = holds
+                return False
+            if status is None:
+                del holds[reservation_id]
+            else:
+                holds[reservation_id] = {**holds[reservation_id], "status": status}
+            doc["holds"] = holds
+            if save_fn(doc):
+                with self._lock:
+                    self._ledgers[key] = dict(holds)
+                return True
+        raise CapacityError(f"{charity_id}: too many concurrent updates, retry")
@@ -0,0 +1,133 @@
+"""
+Cloudant and IAM client shared by the gateway and the command-line tools.
+
+Importing this module has no side effects beyond creating the pooled HTTP session, so
+tools like migrate_partitions.py can use it without starting the gateway.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _env(name: str) -> str:
+    v = os.environ.get(name)
+    if not v:
+        raise RuntimeError(f"Missing env var: {name}")
+    return v
+
+
+# One pooled session for IAM, Cloudant and Groq so TLS connections are reused across requests.
+_http = requests.Session()
+_pool = int(os.environ.get("HTTP_POOL_SIZE", "20"))
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=_pool))
+
+
+IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+_cloudant_token = {"value": None, "exp": 0}
+_cloudant_token_lock = threading.Lock()
+
+
+def cloudant_token() -> str:
+    now = int(time.time())
+    if _cloudant_token["value"] and now < _cloudant_token["exp"] - 60:
+        return _cloudant_token["value"]
+
+    with _cloudant_token_lock:
+        if _cloudant_token["value"] and int(time.time()) < _cloudant_token["exp"] - 60:
+            return _cloudant_token["value"]
+
+        r = _http.post(
+            IAM_URL,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data={
+                "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
+                "apikey": _env("CLOUDANT_APIKEY"),
+            },
+            timeout=20,
+        )
+        r.raise_for_status()
+        j = r.json()
+        _cloudant_token["value"] = j["access_token"]
+        _cloudant_token["exp"] = j["expiration"]
+        return _cloudant_token["value"]
+
+
+def cloudant_request(method: str, path: str, json_body=None, params=None):
+    base = _env("CLOUDANT_URL").rstrip("/")
+    token = cloudant_token()
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/json",
+    }
+    url = f"{base}/{path.lstrip('/')}"
+    resp = _http.request(method, url, headers=headers, json=json_body, params=params, timeout=30)
+    resp.raise_for_status()
+    return resp.json() if resp.text else {}
+
+
+def _find_body(selector: dict, limit: int, fields, bookmark, sort) -> dict:
+    body = {"selector": selector, "limit": limit}
+    if fields:
+        body["fields"] = fields
+    if bookmark:
+        body["bookmark"] = bookmark
+    if sort:
+        body["sort"] = sort
+    return body
+
+
+def cloudant_find(db: str, selector: dict, limit: int = 20, fields=None, bookmark=None, sort=None):
+    return cloudant_request("POST", f"{db}/_find", json_body=_find_body(selector, limit, fields, bookmark, sort))
+
+
+def cloudant_find_partition(db: str, partition: str, selector: dict, limit: int = 20, fields=None, bookmark=None, sort=None):
+    """
+    _find scoped to one partition of a partitioned database, so only that shard is read.
+    """
+    body = _find_body(selector, limit, fields, bookmark, sort)
+    return cloudant_request("POST", f"{db}/_partition/{partition}/_find", json_body=body)
+
+
+def cloudant_get(db: str, doc_id: str):
+    return cloudant_request("GET", f"{db}/{doc_id}")
+
+
+def cloudant_put(db: str, doc: dict):
+    if "_id" not in doc:
+        raise RuntimeError("document missing _id")
+    return cloudant_request("PUT", f"{db}/{doc['_id']}", json_body=doc)
+
+
+def cloudant_docs_with_prefix(db: str, prefix: str) -> list:
+    params = {"include_docs": "true", "startkey": json.dumps(prefix), "endkey": json.dumps(prefix + "\ufff0")}
+    rows = cloudant_request("GET", f"{db}/_all_docs", params=params).get("rows", [])
+    return [r["doc"] for r in rows if r.get("doc")]
+
+
+def cloudant_get_or_default(db: str, doc_id: str, default: dict) -> dict:
+    try:
+        return cloudant_get(db, doc_id)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return dict(default)
+        raise
+
+
+def cloudant_put_if_current(db: str, doc: dict) -> bool:
+    """
+    PUT guarded by the doc's _rev. Returns False on a 409 conflict so callers can reload and retry.
+    """
+    try:
+        out = cloudant_put(db, doc)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 409:
+            return False
+        raise
+    if out.get("rev"):
+        doc["_rev"] = out["rev"]
+    return True
@@ -0,0 +1,205 @@
+import itertools
+import re
+import threading
+import time
+import zlib
+from collections import deque
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_MASK32 = 0xFFFFFFFF
+_TIME_WORDS = frozenset(("am", "pm", "noon", "midnight", "today", "tonight", "tomorrow"))
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD_RE.findall((text or "").lower()))
+
+
+def shingles(text: str, k: int = 4) -> set:
+    """
+    Character k-grams of the normalized text, so small rewordings still share most shingles.
+    """
+    t = normalize(text)
+    if len(t) <= k:
+        return {t} if t else set()
+    return {t[i:i + k] for i in range(len(t) - k + 1)}
+
+
+def facts(text: str) -> tuple:
+    """
+    Tokens that carry quantities, times and house numbers: anything with a digit, plus
+    am/pm and day words. Two posts with different facts are different donations however
+    similar the rest of the wording is.
+    """
+    return tuple(sorted(t for t in normalize(text).split() if t in _TIME_WORDS or any(c.isdigit() for c in t)))
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures with an LSH band index over a sliding time window of messages.
+
+    Signatures use one-permutation hashing: every shingle is hashed once and the hash picks
+    both a bin and the value competing for that bin's minimum. Empty bins borrow from the
+    next non-empty bin (rotation densification). That keeps signing O(shingles + num_perm)
+    instead of O(shingles * num_perm). Candidates come from any shared LSH band and are
+    confirmed by the estimated Jaccard similarity against `threshold`.
+
+    Entries are scoped (typically by restaurant_id) so only messages in the same scope can match.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.6,
+        window_s: float = 7200,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 4,
+        max_entries: int = 200_000,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.window_s = window_s
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._entries = {}
+        self._order = deque()
+        self._buckets = {}
+
+    # ----------------------------
+    # Signatures
+    # ----------------------------
+    def signature(self, text: str) -> tuple:
+        n = self.num_perm
+        sig = [_MASK32] * n
+        for sh in shingles(text, self.shingle_size):
+            h = (zlib.crc32(sh.encode("utf-8")) * 0x9E3779B1) & _MASK32
+            b = h % n
+            v = h // n
+            if v < sig[b]:
+                sig[b] = v
+
+        if _MASK32 not in sig:
+            return tuple(sig)
+        # Densify: an empty bin takes the value of the next filled bin to its right (wrapping),
+        # offset by its distance so borrowed values never collide with real ones.
+        out = list(sig)
+        step = _MASK32 // n
+        nxt, dist = None, 0
+        for k in range(2 * n):
+            i = (n - 1 - k) % n
+            if sig[i] != _MASK32:
+                nxt, dist = sig[i], 0
+            else:
+                dist += 1
+                if nxt is not None:
+                    out[i] = nxt + dist * step
+        return tuple(out)
+
+    @staticmethod
+    def similarity(a: tuple, b: tuple) -> float:
+        return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+    def _band_keys(self, scope: str, sig: tuple) -> list:
+        r = self.rows
+        return [(scope, i, sig[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    # ----------------------------
+    # Index operations
+    # ----------------------------
+    def query(self, text: str, scope: str = "*", now=None, sig=None):
+        """
+        Best match in the window for `text` within `scope`, or None.
+        Returns {"message_id", "similarity", "received_at", "result", "facts"}.
+        """
+        sig = sig or self.signature(text)
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._evict_locked(now)
+            best, best_sim = None, self.threshold
+            seen = set()
+            for key in self._band_keys(scope, sig):
+                for eid in self._buckets.get(key, ()):
+                    if eid in seen:
+                        continue
+                    seen.add(eid)
+                    sim = self.similarity(sig, self._entries[eid]["sig"])
+                    if sim >= best_sim:
+                        best, best_sim = eid, sim
+            if best is None:
+                return None
+            e = self._entries[best]
+            return {
+                "message_id": best,
+                "similarity": round(best_sim, 3),
+                "received_at": e["ts"],
+                "result": e["result"],
+                "facts": e["facts"],
+            }
+
+    def add(self, text: str, scope: str = "*", result=None, now=None, sig=None) -> int:
+        sig = sig or self.signature(text)
+        now = now if now is not None else time.time()
+        with self._lock:
+            self._evict_locked(now)
+            eid = next(self._ids)
+            keys = self._band_keys(scope, sig)
+            self._entries[eid] = {"sig": sig, "ts": now, "keys": keys, "result": result, "facts": facts(text)}
+            self._order.append(eid)
+            for key in keys:
+                self._buckets.setdefault(key, set()).add(eid)
+            while len(self._order) > self.max_entries:
+                self._drop_locked(self._order.popleft())
+            return eid
+
+    def check_and_add(self, text: str, scope: str = "*", now=None):
+        """
+        Query then insert under the same signature. Returns (match or None, new message_id).
+        """
+        sig = self.signature(text)
+        match = self.query(text, scope, now=now, sig=sig)
+        return match, self.add(text, scope, now=now, sig=sig)
+
+    def set_result(self, message_id: int, result) -> None:
+        with self._lock:
+            e = self._entries.get(message_id)
+            if e is not None:
+                e["result"] = result
+
+    def discard(self, message_id: int) -> None:
+        """
+        Forget an entry, e.g. when its extraction failed and the post will be retried.
+        """
+        with self._lock:
+            self._drop_locked(message_id)
+            try:
+                self._order.remove(message_id)
+            except ValueError:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # ----------------------------
+    # Internals
+    # ----------------------------
+    def _evict_locked(self, now: float) -> None:
+        cutoff = now - self.window_s
+        while self._order and self._entries[self._order[0]]["ts"] < cutoff:
+            self._drop_locked(self._order.popleft())
+
+    def _drop_locked(self, eid: int) -> None:
+        e = self._entries.pop(eid, None)
+        if e is None:
+            return
+        for key in e["keys"]:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(eid)
+                if not bucket:
+                    del self._buckets[key]
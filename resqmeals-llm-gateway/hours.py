@@ -0,0 +1,275 @@
+import hashlib
+import re
+import threading
+from datetime import datetime, timedelta
+
+# Opening hours are compiled into a weekly bitmap held in a Python int:
+# bit i is set when the charity is open during 15-minute slot i of the week,
+# counting from Monday 00:00 local time.
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+FULL_WEEK = (1 << WEEK_SLOTS) - 1
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Whole day names only ("sun", "sundays", "thurs."), so "Sunset Blvd" or "Monument St" is not a day.
+_DAY = r"(mon(?:day)?|tues?(?:day)?|wed(?:nesday)?|thu(?:rs?)?(?:day)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)s?\b\.?"
+_CLOCK = r"(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
+_DAY_RANGE_RE = re.compile(rf"\b{_DAY}\s*(?:-|–|to|through)\s*{_DAY}")
+_DAY_RE = re.compile(rf"\b{_DAY}")
+_TIME_RANGE_RE = re.compile(rf"{_CLOCK}\s*(?:-|–|to|until|till)\s*{_CLOCK}")
+_CLOCK_RE = re.compile(rf"\b{_CLOCK}")
+_ALL_DAY_RE = re.compile(r"24\s*/\s*7|24\s*h(?:ou)?rs?|open\s+24|always open|all day")
+_DAY_GROUPS = [
+    (re.compile(r"\b(daily|every\s*day|7\s*days|all\s*week)\b"), range(7)),
+    (re.compile(r"\bweekdays?\b"), range(5)),
+    (re.compile(r"\bweekends?\b"), range(5, 7)),
+]
+
+
+def _normalize(text: str) -> str:
+    t = text.lower()
+    t = re.sub(r"\bnoon\b|\bmidday\b", "12pm", t)
+    t = re.sub(r"\bmidnight\b", "12am", t)
+    return t
+
+
+def _minutes(hour: str, minute, meridiem) -> int:
+    h, m = int(hour), int(minute or 0)
+    if meridiem:
+        pm = meridiem.startswith("p")
+        h = h % 12 + (12 if pm else 0)
+    return h * 60 + m
+
+
+def _range_minutes(g) -> tuple:
+    """
+    Start/end minutes of a matched time range, inferring a missing am/pm from the other end.
+    """
+    h1, m1, mer1, h2, m2, mer2 = g
+    if mer2 and not mer1:
+        start = _minutes(h1, m1, mer2)
+        end = _minutes(h2, m2, mer2)
+        if start > end:
+            start = _minutes(h1, m1, "am" if mer2.startswith("p") else "pm")
+        return start, end
+    start = _minutes(h1, m1, mer1)
+    end = _minutes(h2, m2, mer2 or mer1)
+    # "9-5" means 9am-5pm, but "22:00-02:00" or "08-14" is already on a 24-hour clock.
+    twelve_hour = not (mer1 or mer2) and all(int(h) <= 12 and not h.startswith("0") for h in (h1, h2))
+    if twelve_hour and end <= start:
+        end += 12 * 60
+    return start, end
+
+
+def _day_mask(day: int, start_min: int, end_min: int) -> int:
+    """
+    Slots for [start_min, end_min) on `day`; ranges past midnight spill into the next day.
+    """
+    if end_min <= start_min:
+        end_min += 24 * 60
+    first = day * SLOTS_PER_DAY + start_min // SLOT_MINUTES
+    last = day * SLOTS_PER_DAY + -(-end_min // SLOT_MINUTES)
+    return _slots_mask(first, last)
+
+
+def _slots_mask(first: int, last: int) -> int:
+    """
+    Bits [first, last) wrapped around the week.
+    """
+    span = last - first
+    if span >= WEEK_SLOTS:
+        return FULL_WEEK
+    first %= WEEK_SLOTS
+    mask = ((1 << span) - 1) << first
+    return (mask | (mask >> WEEK_SLOTS)) & FULL_WEEK
+
+
+def _day_index(name: str) -> int:
+    return DAYS.index(name[:3])
+
+
+def _days_in(token_text: str) -> list:
+    m = _DAY_RANGE_RE.fullmatch(token_text.strip())
+    if m:
+        a, b = _day_index(m.group(1)), _day_index(m.group(2))
+        return [(a + i) % 7 for i in range((b - a) % 7 + 1)]
+    return [_day_index(d) for d in _DAY_RE.findall(token_text)]
+
+
+def compile_hours(hours):
+    """
+    Compile free-form opening hours into a weekly bitmap, or None if no open hours were understood.
+
+    Accepts text like "Mon-Fri 9am-5pm, Sat 10-14", "daily 08:00-20:00", "24/7", or a dict
+    mapping day names to such text ({"mon": "9-17", "sat": "closed"}).
+    """
+    if not hours:
+        return None
+    if isinstance(hours, dict):
+        text = "; ".join(f"{k} {v}" for k, v in hours.items())
+    elif isinstance(hours, (list, tuple)):
+        text = "; ".join(str(h) for h in hours)
+    else:
+        text = str(hours)
+
+    t = _normalize(text)
+    if _ALL_DAY_RE.search(t) and not _TIME_RANGE_RE.search(t):
+        return FULL_WEEK
+
+    tokens = []
+    for rx, days in _DAY_GROUPS:
+        for m in rx.finditer(t):
+            tokens.append((m.start(), m.end(), "days", list(days)))
+    for m in _DAY_RANGE_RE.finditer(t):
+        tokens.append((m.start(), m.end(), "days", _days_in(m.group(0))))
+    for m in _DAY_RE.finditer(t):
+        tokens.append((m.start(), m.end(), "days", [_day_index(m.group(1))]))
+    for m in _TIME_RANGE_RE.finditer(t):
+        tokens.append((m.start(), m.end(), "time", _range_minutes(m.groups())))
+    for m in re.finditer(r"\bclosed\b", t):
+        tokens.append((m.start(), m.end(), "closed", None))
+
+    # Keep the longest token at each position and drop tokens nested inside another.
+    tokens.sort(key=lambda tok: (tok[0], -(tok[1] - tok[0])))
+    kept, covered_to = [], -1
+    for tok in tokens:
+        if tok[0] >= covered_to:
+            kept.append(tok)
+            covered_to = tok[1]
+
+    bitmap, closed = 0, 0
+    current, after_time, understood, opened = None, False, False, False
+    closed_next = False  # "closed" seen before the days it refers to ("closed Sundays")
+    for _, _, kind, value in kept:
+        if kind == "days" and closed_next:
+            for day in value:
+                closed |= _day_mask(day, 0, 24 * 60)
+            current, after_time, closed_next, understood = None, True, False, True
+        elif kind == "days":
+            current = (current or []) + value if current is not None and not after_time else list(value)
+            after_time = False
+        elif kind == "time":
+            for day in (current if current is not None else range(7)):
+                bitmap |= _day_mask(day, *value)
+            after_time, understood, opened = True, True, True
+        elif kind == "closed" and current is not None and not after_time:
+            for day in current:
+                closed |= _day_mask(day, 0, 24 * 60)
+            after_time, understood = True, True
+        elif kind == "closed":
+            closed_next = True
+
+    if closed_next:
+        # A "closed" with no day after it cannot be placed; guessing would invert the hours.
+        return None
+    if not understood:
+        return FULL_WEEK if _ALL_DAY_RE.search(t) else None
+    if not opened:
+        # Only closed days were listed ("Sat-Sun closed"): the open hours are unknown, not "never".
+        return None
+    return bitmap & ~closed & FULL_WEEK
+
+
+def slot_of(dt: datetime) -> int:
+    return dt.weekday() * SLOTS_PER_DAY + (dt.hour * 60 + dt.minute) // SLOT_MINUTES
+
+
+def window_mask(start: datetime, end: datetime) -> int:
+    """
+    Weekly bitmap covering [start, end). A zero-length window still covers its slot.
+    """
+    first = slot_of(start)
+    span = max(1, -(-int((end - start).total_seconds()) // (SLOT_MINUTES * 60)))
+    return _slots_mask(first, first + span)
+
+
+def open_in_window(bitmaps: list, start: datetime, end: datetime, mode: str = "any") -> list:
+    """
+    One pass over many compiled bitmaps: True/False per entry, None where hours are unknown.
+    mode "any" means open at some point in the window, "all" means open throughout.
+    """
+    w = window_mask(start, end)
+    if mode == "all":
+        return [None if b is None else (b & w) == w for b in bitmaps]
+    return [None if b is None else (b & w) != 0 for b in bitmaps]
+
+
+def deadline_window(phrase: str, ref: datetime, default_span: timedelta = timedelta(minutes=30)):
+    """
+    Turn an extracted pickup_deadline phrase into a (start, end) window in ref's timezone.
+
+    "after 3pm" -> [15:00, midnight) (from ref once 15:00 has passed), "before 8pm" / "by 10 PM" -> [ref, 20:00),
+    "at 9pm" -> [21:00, 21:30), "3-5pm" -> [15:00, 17:00). "tomorrow" and weekday names
+    shift the day. Returns None when no time can be found.
+    """
+    if not phrase:
+        return None
+    t = _normalize(str(phrase))
+
+    day = ref.replace(hour=0, minute=0, second=0, microsecond=0)
+    if "tomorrow" in t:
+        day += timedelta(days=1)
+    else:
+        m = _DAY_RE.search(t)
+        if m:
+            day += timedelta(days=(_day_index(m.group(1)) - ref.weekday()) % 7)
+
+    rng = _TIME_RANGE_RE.search(t)
+    if rng:
+        start_min, end_min = _range_minutes(rng.groups())
+        start = day + timedelta(minutes=start_min)
+        end = day + timedelta(minutes=end_min if end_min > start_min else end_min + 24 * 60)
+        return start, end
+
+    clock = next((m for m in _CLOCK_RE.finditer(t) if m.group(3) or m.group(2)), None)
+    if clock is None:
+        return None
+    at = day + timedelta(minutes=_minutes(*clock.groups()))
+    if re.search(r"\b(after|from)\b", t):
+        # "after 3pm" said at 4pm still means today: the window runs from now until midnight.
+        start = max(at, ref) if day.date() == ref.date() else at
+        return start, max(start + default_span, day + timedelta(days=1))
+    if at < ref and day.date() == ref.date() and not re.search(r"\btoday\b", t):
+        at += timedelta(days=1)
+
+    if re.search(r"\b(before|by|until|till|no later than)\b", t):
+        return min(ref, at), at
+    return at, at + default_span
+
+
+def hours_version(doc: dict) -> str:
+    rev = doc.get("_rev")
+    if rev:
+        return rev
+    return hashlib.sha1(repr(doc.get("hours")).encode("utf-8")).hexdigest()
+
+
+class HoursCache:
+    """
+    Compiled opening-hours bitmaps keyed by charity _id, recompiled only when the doc version changes.
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def bitmap(self, doc: dict):
+        doc_id = doc.get("_id")
+        version = hours_version(doc)
+        with self._lock:
+            hit = self._entries.get(doc_id)
+            if hit and hit[0] == version:
+                return hit[1]
+
+        compiled = compile_hours(doc.get("hours"))
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[doc_id] = (version, compiled)
+        return compiled
+
+    def bitmaps(self, docs: list) -> list:
+        return [self.bitmap(d) for d in docs]
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # br is optional; gzip is always available
+    brotli = None
+
+_ENCODING_SUFFIX = {"br": "-br", "gzip": "-gz"}
+
+
+def revision_etag(docs: list, *salt) -> str:
+    """
+    Strong ETag from the (_id, _rev) pairs of a result set plus anything else shaping the body.
+    """
+    h = hashlib.sha1()
+    for d in docs:
+        h.update(f"{d.get('_id')}\x00{d.get('_rev')}\x01".encode("utf-8"))
+    for s in salt:
+        h.update(f"\x02{s}".encode("utf-8"))
+    return f'"{h.hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """
+    RFC 9110 If-None-Match check. Encoding suffixes added by compress() are ignored,
+    so a validator received on a gzip or br response still matches.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    base = etag.strip('"')
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for suffix in _ENCODING_SUFFIX.values():
+            if tag.endswith(suffix):
+                tag = tag[: -len(suffix)]
+                break
+        if tag == base:
+            return True
+    return False
+
+
+def pick_encoding(accept_encoding: str):
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    return f'"{etag.strip(chr(34))}{_ENCODING_SUFFIX[encoding]}"'
+
+
+class BodyCache:
+    """
+    Small LRU of serialized (and compressed) bodies keyed by (etag, encoding), so an
+    unchanged result set is serialized and compressed once rather than on every poll.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get_or_build(self, key, build) -> bytes:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                return hit
+        body = build()
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return body
+
+
+def dumps(obj) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
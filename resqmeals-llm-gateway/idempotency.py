@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "done", "response", "expires")
+
+    def __init__(self, fingerprint: str, expires: float):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.response = None
+        self.expires = expires
+
+
+class IdempotencyStore:
+    """
+    Bounded TTL store of responses keyed by Idempotency-Key.
+
+    The first request for a key becomes the leader and does the work. Requests with the
+    same key that arrive while it is in flight wait for the leader's response instead of
+    starting again, and requests after it completes get the stored response. A failed
+    leader stores nothing, so the next retry does the work afresh.
+    """
+
+    def __init__(self, ttl_s: float = 900, max_entries: int = 5000):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def begin(self, key: str, fingerprint: str):
+        """
+        Returns ("leader", entry), ("follower", entry), ("replay", response) or ("conflict", None).
+        """
+        now = time.time()
+        with self._lock:
+            self._purge_locked(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.fingerprint != fingerprint:
+                    return "conflict", None
+                if entry.done.is_set():
+                    return "replay", entry.response
+                return "follower", entry
+
+            entry = _Entry(fingerprint, now + self.ttl_s)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return "leader", entry
+
+    def complete(self, key: str, entry: _Entry, response) -> None:
+        with self._lock:
+            entry.response = response
+            entry.expires = time.time() + self.ttl_s
+        entry.done.set()
+
+    def fail(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.done.set()
+
+    @staticmethod
+    def wait(entry: _Entry, timeout: float):
+        """
+        Block until the leader finishes. Returns its response, or None if it failed or timed out.
+        """
+        entry.done.wait(timeout)
+        return entry.response
+
+    def _purge_locked(self, now: float) -> None:
+        for key in [k for k, e in self._entries.items() if e.done.is_set() and e.expires <= now]:
+            del self._entries[key]
@@ -0,0 +1,144 @@
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from geo import geo_of, haversine_miles
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class JobBoard:
+    """
+    In-memory board of pickup jobs with a sequenced change log.
+
+    Every state change (new, accepted, expired) is appended to a bounded log so
+    subscribers can ask for "everything after seq N" and only receive deltas.
+    If a subscriber falls further behind than the log retains, it gets a reset
+    with the current open jobs instead.
+    """
+
+    def __init__(self, max_events: int = 2000, default_ttl_s: int = 3600):
+        self.default_ttl_s = default_ttl_s
+        self._jobs = {}
+        self._events = deque(maxlen=max_events)
+        self._seq = 0
+        # Sequence numbers restart with the process; the epoch tells clients they did.
+        self.epoch = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+
+    # ----------------------------
+    # Mutations
+    # ----------------------------
+    def publish(self, job: dict, ttl_s=None) -> dict:
+        now = time.time()
+        ttl = int(ttl_s if ttl_s is not None else self.default_ttl_s)
+        job = {
+            **job,
+            "job_id": job.get("job_id") or f"job_{uuid.uuid4().hex[:8]}",
+            "created_at": _iso(now),
+            "expires_at": _iso(now + ttl),
+            "status": "open",
+            "accepted_by": None,
+            "accepted_at": None,
+        }
+        with self._cond:
+            self._expire_locked(now)
+            self._jobs[job["job_id"]] = {"job": job, "expires": now + ttl}
+            self._emit_locked("new", job)
+        return job
+
+    def accept(self, job_id: str, driver_id: str, driver_name: str):
+        with self._cond:
+            self._expire_locked(time.time())
+            entry = self._jobs.get(job_id)
+            if not entry:
+                return False, "Job not found.", None
+
+            job = entry["job"]
+            if job["status"] != "open":
+                return False, f"Job is already {job['status']}.", job
+
+            job["status"] = "accepted"
+            job["accepted_by"] = {"id": driver_id, "name": driver_name}
+            job["accepted_at"] = datetime.now(timezone.utc).isoformat()
+            self._emit_locked("accepted", job)
+            return True, "Accepted.", job
+
+    def get(self, job_id: str):
+        with self._cond:
+            entry = self._jobs.get(job_id)
+            return dict(entry["job"]) if entry else None
+
+    # ----------------------------
+    # Subscriptions
+    # ----------------------------
+    def changes(self, since: int, wait_s: float = 0.0, near=None, radius_miles=None, epoch=None) -> dict:
+        """
+        Return events after `since`, blocking up to `wait_s` until at least one arrives.
+
+        `near` is an optional (lat, lon); when given with `radius_miles`, only jobs
+        inside that radius are reported. Jobs without a position are always reported.
+        A client whose `since` or `epoch` belongs to an earlier process gets a reset.
+        """
+        deadline = time.time() + max(0.0, wait_s)
+        with self._cond:
+            while True:
+                now = time.time()
+                self._expire_locked(now)
+
+                oldest = self._events[0]["seq"] if self._events else self._seq + 1
+                restarted = since > self._seq or (epoch is not None and epoch != self.epoch)
+                if since < oldest - 1 or restarted:
+                    jobs = [e["job"] for e in self._jobs.values() if e["job"]["status"] == "open"]
+                    return {
+                        "seq": self._seq,
+                        "epoch": self.epoch,
+                        "reset": True,
+                        "jobs": [dict(j) for j in jobs if self._in_range(j, near, radius_miles)],
+                        "events": [],
+                    }
+
+                events = [
+                    e for e in self._events
+                    if e["seq"] > since and self._in_range(e["job"], near, radius_miles)
+                ]
+                remaining = deadline - now
+                if events or remaining <= 0:
+                    return {"seq": self._seq, "epoch": self.epoch, "reset": False, "jobs": [], "events": events}
+
+                self._cond.wait(timeout=min(remaining, self._next_expiry_in(now)))
+
+    # ----------------------------
+    # Internals
+    # ----------------------------
+    def _emit_locked(self, kind: str, job: dict) -> None:
+        self._seq += 1
+        self._events.append({"seq": self._seq, "kind": kind, "job_id": job["job_id"], "job": dict(job)})
+        self._cond.notify_all()
+
+    def _expire_locked(self, now: float) -> None:
+        for job_id, entry in list(self._jobs.items()):
+            if entry["expires"] > now:
+                continue
+            job = entry["job"]
+            if job["status"] == "open":
+                job["status"] = "expired"
+                self._emit_locked("expired", job)
+            del self._jobs[job_id]
+
+    def _next_expiry_in(self, now: float) -> float:
+        pending = [e["expires"] for e in self._jobs.values() if e["job"]["status"] == "open"]
+        return max(0.05, min(pending) - now) if pending else 60.0
+
+    @staticmethod
+    def _in_range(job: dict, near, radius_miles) -> bool:
+        if near is None or radius_miles is None:
+            return True
+        pos = geo_of(job)
+        if pos is None:
+            return True
+        return haversine_miles(near[0], near[1], pos[0], pos[1]) <= radius_miles
@@ -0,0 +1,133 @@
+import math
+import threading
+import time
+from array import array
+
+from geo import haversine_miles
+
+MILES_PER_DEGREE_LAT = 69.0
+
+
+class LocationStore:
+    """
+    Latest GPS fix per driver, held in parallel arrays with a uniform lat/lon grid index.
+
+    Each driver owns one slot; an update overwrites the slot in place (older fixes are
+    dropped), so memory stays proportional to the number of drivers, not pings. The grid
+    maps cells of `cell_deg` degrees to slot numbers for radius lookups.
+    """
+
+    def __init__(self, cell_deg: float = 0.05, max_skew_s: float = 30.0):
+        self.cell_deg = cell_deg
+        self.max_skew_s = max_skew_s
+        self._lock = threading.Lock()
+        self._slot = {}
+        self._ids = []
+        self._lat = array("d")
+        self._lon = array("d")
+        self._ts = array("d")
+        self._cell = []
+        self._grid = {}
+
+    def _cell_of(self, lat: float, lon: float) -> tuple:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def ingest(self, updates) -> dict:
+        """
+        Apply a batch of fixes. Each update is {"driver_id", "lat", "lon", "ts"?} or
+        [driver_id, lat, lon, ts?]; ts is epoch seconds and defaults to now. Millisecond
+        timestamps are scaled down, and ones ahead of the clock by more than max_skew_s are
+        clamped to now, so one bad device clock cannot make every later fix look stale.
+        """
+        now = time.time()
+        accepted = stale = rejected = 0
+        with self._lock:
+            for u in updates:
+                try:
+                    if isinstance(u, dict):
+                        did, lat, lon, ts = u["driver_id"], float(u["lat"]), float(u["lon"]), u.get("ts")
+                    else:
+                        did, lat, lon = u[0], float(u[1]), float(u[2])
+                        ts = u[3] if len(u) > 3 else None
+                    if not isinstance(did, str) or not did:
+                        raise TypeError("driver_id must be a non-empty string")
+                    ts = float(ts) if ts is not None else now
+                    if ts > 1e11:
+                        ts /= 1000.0
+                    if ts > now + self.max_skew_s:
+                        ts = now
+                except (KeyError, IndexError, TypeError, ValueError):
+                    rejected += 1
+                    continue
+                if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+                    rejected += 1
+                    continue
+
+                cell = self._cell_of(lat, lon)
+                i = self._slot.get(did)
+                if i is None:
+                    i = len(self._ids)
+                    self._slot[did] = i
+                    self._ids.append(did)
+                    self._lat.append(lat)
+                    self._lon.append(lon)
+                    self._ts.append(ts)
+                    self._cell.append(cell)
+                    self._grid.setdefault(cell, set()).add(i)
+                    accepted += 1
+                    continue
+
+                if ts < self._ts[i]:
+                    stale += 1
+                    continue
+                self._lat[i], self._lon[i], self._ts[i] = lat, lon, ts
+                old = self._cell[i]
+                if old != cell:
+                    members = self._grid[old]
+                    members.discard(i)
+                    if not members:
+                        del self._grid[old]
+                    self._grid.setdefault(cell, set()).add(i)
+                    self._cell[i] = cell
+                accepted += 1
+        return {"accepted": accepted, "stale": stale, "rejected": rejected}
+
+    def position(self, driver_id: str):
+        with self._lock:
+            i = self._slot.get(driver_id)
+            if i is None:
+                return None
+            return self._lat[i], self._lon[i], self._ts[i]
+
+    def nearby(self, lat: float, lon: float, radius_miles: float, max_age_s=None) -> list:
+        """
+        Drivers within radius_miles, nearest first: [(driver_id, miles, lat, lon, ts), ...].
+        """
+        dlat = radius_miles / MILES_PER_DEGREE_LAT
+        dlon = radius_miles / (MILES_PER_DEGREE_LAT * max(0.01, math.cos(math.radians(lat))))
+        lo = self._cell_of(lat - dlat, lon - dlon)
+        hi = self._cell_of(lat + dlat, lon + dlon)
+        cutoff = time.time() - max_age_s if max_age_s else None
+
+        out = []
+        with self._lock:
+            for cy in range(lo[0], hi[0] + 1):
+                for cx in range(lo[1], hi[1] + 1):
+                    for i in self._grid.get((cy, cx), ()):
+                        if cutoff is not None and self._ts[i] < cutoff:
+                            continue
+                        d = haversine_miles(lat, lon, self._lat[i], self._lon[i])
+                        if d <= radius_miles:
+                            out.append((self._ids[i], d, self._lat[i], self._lon[i], self._ts[i]))
+        out.sort(key=lambda r: r[1])
+        return out
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {did: [self._lat[i], self._lon[i], self._ts[i]] for did, i in self._slot.items()}
+
+    def load(self, positions: dict) -> None:
+        self.ingest([[did, p[0], p[1], p[2]] for did, p in (positions or {}).items()])
+
+    def __len__(self) -> int:
+        return len(self._ids)
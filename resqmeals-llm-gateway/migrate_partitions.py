@@ -0,0 +1,177 @@
+"""
+Copy a ResQMeals database into a Cloudant partitioned database keyed by city.
+
+Every document is re-keyed to "{city}:{old _id}" (the old id is kept in legacy_id). The
+city comes from the doc's "city" field, otherwise from the nearest CITY_CENTROIDS entry
+to its geo. Audit docs have no geo, so they take the city of their restaurant; pass the
+restaurants database with --restaurants-db and their restaurant_id is rewritten to the
+re-keyed id as well. Pass --charities-db and --drivers-db to rewrite the selected_charity
+and selected_driver ids in audits, and the driver ids in the driver_locations:snapshot
+positions. System docs (capacity ledgers, rollup and location snapshots, held batch
+entries) keep their ids, which already name a partition. Design docs are not copied.
+
+Reads go through _all_docs in pages and writes through _bulk_docs, so the source is never
+modified. Re-running is safe: docs already in the target come back as conflicts and are
+counted as "existing".
+
+    CLOUDANT_URL=... CLOUDANT_APIKEY=... CITY_CENTROIDS="oslo=59.91,10.75;london=51.51,-0.13" \\
+        python migrate_partitions.py resqmeals_restaurants resqmeals_restaurants_p --create
+    python migrate_partitions.py resqmeals_charities resqmeals_charities_p --create
+    python migrate_partitions.py resqmeals_drivers resqmeals_drivers_p --create \\
+        --drivers-db resqmeals_drivers
+    python migrate_partitions.py resqmeals_audit resqmeals_audit_p --create \\
+        --restaurants-db resqmeals_restaurants --charities-db resqmeals_charities \\
+        --drivers-db resqmeals_drivers
+
+Then point CLOUDANT_DB_* at the new databases and set CLOUDANT_PARTITIONED=1.
+"""
+import argparse
+import json
+import os
+import sys
+
+import requests
+
+from cloudant import cloudant_request
+from partitions import SYSTEM_PREFIXES, parse_centroids, partition_of, partitioned_id, rekey
+
+
+def all_docs(db: str, page_size: int):
+    """
+    Yield pages of full docs from _all_docs, paging on the last key seen.
+    """
+    start = None
+    while True:
+        params = {"include_docs": "true", "limit": page_size + 1}
+        if start is not None:
+            params["startkey"] = json.dumps(start)
+        rows = cloudant_request("GET", f"{db}/_all_docs", params=params).get("rows", [])
+        if len(rows) > page_size:
+            start = rows[-1]["id"]
+            rows = rows[:-1]
+        else:
+            start = None
+        yield [r["doc"] for r in rows if r.get("doc")]
+        if start is None:
+            return
+
+
+def create_partitioned(db: str) -> None:
+    try:
+        cloudant_request("PUT", db, params={"partitioned": "true"})
+        print(f"created partitioned database {db}")
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 412:
+            raise
+        print(f"{db} already exists")
+
+
+def doc_partitions(db: str, doc_type: str, centroids: dict, max_miles: float, page_size: int) -> dict:
+    """
+    {old _id: city} for every doc of `doc_type` in `db`.
+    """
+    out = {}
+    if not db:
+        return out
+    for docs in all_docs(db, page_size):
+        for d in docs:
+            if d.get("type") == doc_type:
+                out[d["_id"]] = partition_of(d, centroids, max_miles)
+    return out
+
+
+def rekey_id(doc_id, partitions: dict):
+    """
+    Re-keyed id for a reference to another database, or the id unchanged if its city is unknown.
+    """
+    city = partitions.get(doc_id)
+    return partitioned_id(city, doc_id) if city else doc_id
+
+
+def rekey_ref(ref, partitions: dict):
+    """
+    Rewrite the id of an embedded doc (selected_charity, selected_driver), keeping the old one in legacy_id.
+    """
+    if not isinstance(ref, dict):
+        return ref
+    key = "_id" if ref.get("_id") else "id"
+    new_id = rekey_id(ref.get(key), partitions)
+    if new_id == ref.get(key):
+        return ref
+    return {**ref, key: new_id, "legacy_id": ref[key]}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("source")
+    ap.add_argument("target")
+    ap.add_argument("--create", action="store_true", help="create the target as a partitioned database")
+    ap.add_argument("--restaurants-db", help="restaurants database used to place audit docs")
+    ap.add_argument("--charities-db", help="charities database used to rewrite selected_charity ids")
+    ap.add_argument("--drivers-db", help="drivers database used to rewrite selected_driver and snapshot ids")
+    ap.add_argument("--default-city", help="partition for docs whose city cannot be derived (otherwise skipped)")
+    ap.add_argument("--max-miles", type=float, default=float(os.environ.get("CITY_MAX_MILES", "60")))
+    ap.add_argument("--page-size", type=int, default=500)
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    centroids = parse_centroids(os.environ.get("CITY_CENTROIDS", ""))
+    if not centroids:
+        print("CITY_CENTROIDS is empty: only docs with a city field can be placed", file=sys.stderr)
+
+    by_restaurant = doc_partitions(args.restaurants_db, "restaurant", centroids, args.max_miles, args.page_size)
+    by_charity = doc_partitions(args.charities_db, "charity", centroids, args.max_miles, args.page_size)
+    by_driver = doc_partitions(args.drivers_db, "driver", centroids, args.max_miles, args.page_size)
+
+    if args.create and not args.dry_run:
+        create_partitioned(args.target)
+
+    stats = {"copied": 0, "existing": 0, "skipped_design": 0, "unplaced": 0, "failed": 0}
+    for docs in all_docs(args.source, args.page_size):
+        batch = []
+        for d in docs:
+            doc_id = d["_id"]
+            if doc_id.startswith("_design/"):
+                stats["skipped_design"] += 1
+                continue
+            if doc_id.split(":", 1)[0] in SYSTEM_PREFIXES:
+                system = {k: v for k, v in d.items() if k != "_rev"}
+                if isinstance(system.get("positions"), dict):
+                    system["positions"] = {rekey_id(did, by_driver): p for did, p in system["positions"].items()}
+                batch.append(system)
+                continue
+
+            rid = d.get("restaurant_id")
+            city = partition_of(d, centroids, args.max_miles) or by_restaurant.get(rid) or args.default_city
+            if not city:
+                stats["unplaced"] += 1
+                print(f"no city for {doc_id}", file=sys.stderr)
+                continue
+            new = rekey(d, city)
+            if rid in by_restaurant and by_restaurant[rid]:
+                new["restaurant_id"] = partitioned_id(by_restaurant[rid], rid)
+                new["legacy_restaurant_id"] = rid
+            for field, partitions in (("selected_charity", by_charity), ("selected_driver", by_driver)):
+                if field in new:
+                    new[field] = rekey_ref(new[field], partitions)
+            batch.append(new)
+
+        if args.dry_run:
+            stats["copied"] += len(batch)
+            continue
+        if not batch:
+            continue
+        for res in cloudant_request("POST", f"{args.target}/_bulk_docs", json_body={"docs": batch}):
+            if res.get("ok"):
+                stats["copied"] += 1
+            elif res.get("error") == "conflict":
+                stats["existing"] += 1
+            else:
+                stats["failed"] += 1
+                print(f"{res.get('id')}: {res.get('error')} {res.get('reason')}", file=sys.stderr)
+
+    print(json.dumps({"source": args.source, "target": args.target, "dry_run": args.dry_run, **stats}))
+
+
+if __name__ == "__main__":
+    main()
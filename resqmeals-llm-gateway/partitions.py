@@ -0,0 +1,85 @@
+import re
+
+from geo import geo_of, haversine_miles
+
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+# Docs whose id prefix already names a shared partition (system docs read by id or
+# by id prefix): they keep their ids when a database is re-keyed.
+SYSTEM_PREFIXES = ("capacity", "rollup", "driver_locations", "batch")
+
+
+def city_slug(name) -> str:
+    """
+    Partition key for a city name: "São Paulo" -> "s-o-paulo", "Oslo" -> "oslo".
+    Cloudant partition keys cannot contain ":" or start with "_".
+    """
+    return _SLUG_RE.sub("-", str(name or "").lower()).strip("-")
+
+
+def parse_centroids(spec: str) -> dict:
+    """
+    CITY_CENTROIDS env value "oslo=59.91,10.75;london=51.51,-0.13" -> {"oslo": (59.91, 10.75), ...}.
+    """
+    out = {}
+    for part in (spec or "").split(";"):
+        name, _, coords = part.partition("=")
+        lat, _, lon = coords.partition(",")
+        if not name.strip() or not lon.strip():
+            continue
+        out[city_slug(name)] = (float(lat), float(lon))
+    return out
+
+
+def nearest_city(lat: float, lon: float, centroids: dict, max_miles: float = None):
+    best, best_d = None, None
+    for city, (clat, clon) in centroids.items():
+        d = haversine_miles(lat, lon, clat, clon)
+        if best_d is None or d < best_d:
+            best, best_d = city, d
+    if best is None or (max_miles is not None and best_d > max_miles):
+        return None
+    return best
+
+
+def partition_of(doc: dict, centroids: dict, max_miles: float = None):
+    """
+    City partition for a doc: its "city" field if set, otherwise the nearest centroid to its geo.
+    """
+    city = city_slug((doc or {}).get("city"))
+    if city:
+        return city
+    pos = geo_of(doc)
+    if pos is None:
+        return None
+    return nearest_city(pos[0], pos[1], centroids, max_miles)
+
+
+def partition_from_id(doc_id) -> str:
+    """
+    Partition prefix of a partitioned id ("oslo:restaurant:x" -> "oslo"), or None for
+    legacy ids whose first segment is a doc type.
+    """
+    head, sep, _ = str(doc_id or "").partition(":")
+    if not sep or head in ("restaurant", "charity", "driver", "audit") or head in SYSTEM_PREFIXES:
+        return None
+    return head
+
+
+def partitioned_id(partition: str, doc_id: str) -> str:
+    if partition_from_id(doc_id) == partition:
+        return doc_id
+    return f"{partition}:{doc_id}"
+
+
+def rekey(doc: dict, partition: str) -> dict:
+    """
+    Copy of `doc` for a partitioned database: id prefixed with the partition, no _rev,
+    original id kept in legacy_id and the partition in city.
+    """
+    out = {k: v for k, v in doc.items() if k != "_rev"}
+    out["_id"] = partitioned_id(partition, doc["_id"])
+    if out["_id"] != doc["_id"]:
+        out["legacy_id"] = doc["_id"]
+    out.setdefault("city", partition)
+    return out
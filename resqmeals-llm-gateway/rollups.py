@@ -0,0 +1,304 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+GRANULARITIES = {
+    # name: (bucket key length in an ISO timestamp, step between buckets)
+    "hour": (13, timedelta(hours=1)),
+    "day": (10, timedelta(days=1)),
+}
+DIMENSIONS = ("all", "restaurant", "charity", "driver")
+
+
+def donation_portions(extracted) -> float:
+    """
+    Sum of numeric food_items quantities. Non-numeric quantities count as zero.
+    """
+    total = 0.0
+    for it in (extracted or {}).get("food_items") or []:
+        try:
+            total += float(it.get("quantity"))
+        except (AttributeError, TypeError, ValueError):
+            continue
+    return total
+
+
+def _ref_id(obj):
+    if not isinstance(obj, dict):
+        return None
+    return obj.get("_id") or obj.get("id")
+
+
+def bucket_of(ts: str, granularity: str) -> str:
+    return ts[:GRANULARITIES[granularity][0]]
+
+
+def bucket_range(granularity: str, since: str, until: str, max_buckets: int = 1000) -> list:
+    """
+    Bucket keys from since to until inclusive, both given as ISO timestamps or prefixes.
+    """
+    width, step = GRANULARITIES[granularity]
+    fmt = "%Y-%m-%dT%H" if granularity == "hour" else "%Y-%m-%d"
+    cur = datetime.strptime(since[:width], fmt)
+    end = datetime.strptime(until[:width], fmt)
+    out = []
+    while cur <= end and len(out) < max_buckets:
+        out.append(cur.strftime(fmt))
+        cur += step
+    return out
+
+
+def shard_key(granularity: str, bucket: str) -> str:
+    """
+    Checkpoint shard for a bucket: one document per granularity per month ("day:2026-10").
+    """
+    return f"{granularity}:{bucket[:7]}"
+
+
+def split_shards(counters: dict) -> dict:
+    """
+    {granularity: {dim: {bucket: ...}}} -> {shard: {dim: {bucket: ...}}}.
+    """
+    out = {}
+    for gran, dims in counters.items():
+        for dim, buckets in dims.items():
+            for bucket, keys in buckets.items():
+                out.setdefault(shard_key(gran, bucket), {}).setdefault(dim, {})[bucket] = keys
+    return out
+
+
+def _add(counters: dict, granularity: str, dim: str, bucket: str, key: str, dispatches: float, portions: float):
+    slot = counters.setdefault(granularity, {}).setdefault(dim, {}).setdefault(bucket, {})
+    cur = slot.get(key) or [0, 0.0]
+    slot[key] = [cur[0] + dispatches, cur[1] + portions]
+
+
+def _merge(into: dict, other: dict) -> dict:
+    for gran, dims in other.items():
+        for dim, buckets in dims.items():
+            for bucket, keys in buckets.items():
+                for key, (n, portions) in keys.items():
+                    _add(into, gran, dim, bucket, key, n, portions)
+    return into
+
+
+class _Superseded(Exception):
+    def __init__(self, generation):
+        super().__init__(f"rollup rebuilt as generation {generation}")
+        self.generation = generation
+
+
+class RollupStore:
+    """
+    Hour/day dispatch counters by restaurant, charity and driver, updated per audit write.
+
+    Counters are nested as counters[granularity][dimension][bucket][key] = [dispatches, portions],
+    so a dashboard query is a handful of dict lookups no matter how many audits exist.
+    Local increments accumulate in `_pending` and are folded into Cloudant checkpoint documents,
+    one per granularity per month so no document outgrows Cloudant's size limit, with
+    optimistic concurrency on _rev, which lets several gateway instances share them.
+    """
+
+    def __init__(self, hour_retention_days: int = 14, day_retention_days: int = 400):
+        self.retention = {"hour": timedelta(days=hour_retention_days), "day": timedelta(days=day_retention_days)}
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._pending = {}
+        self._inflight = {}
+        self._loaded_at = 0.0
+        self._checkpointed_at = time.time()
+        self._checkpointing = False
+        # Set by a rebuild on every shard. Pending increments from before a rebuild were already
+        # counted by its scan, so they are dropped instead of being checkpointed on top of it.
+        self.generation = None
+        self._synced = False
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def record(self, doc: dict) -> None:
+        ts = doc.get("created_at") or datetime.now(timezone.utc).isoformat()
+        extracted = doc.get("extracted")
+        if isinstance(extracted, str):
+            try:
+                extracted = json.loads(extracted)
+            except ValueError:
+                extracted = None
+        portions = donation_portions(extracted if isinstance(extracted, dict) else None)
+        keys = {
+            "all": "all",
+            "restaurant": doc.get("restaurant_id"),
+            "charity": _ref_id(doc.get("selected_charity")),
+            "driver": _ref_id(doc.get("selected_driver")),
+        }
+        with self._lock:
+            for gran in GRANULARITIES:
+                bucket = bucket_of(ts, gran)
+                for dim, key in keys.items():
+                    if key:
+                        _add(self._pending, gran, dim, bucket, key, 1, portions)
+
+    def checkpoint_due(self, interval_s: float) -> bool:
+        with self._lock:
+            if self._checkpointing or not self._pending:
+                return False
+            return time.time() - self._checkpointed_at >= interval_s
+
+    def checkpoint(self, load_fn, save_fn, attempts: int = 5) -> bool:
+        """
+        Fold pending increments into the checkpoint shards they touch.
+
+        load_fn(shard) returns that shard's document (or {}); save_fn(doc) returns False on a
+        _rev conflict, in which case the document is reloaded and the merge retried. Shards
+        that cannot be saved keep their increments pending for the next checkpoint. A shard
+        written by a newer rebuild generation discards the whole batch.
+        """
+        with self._lock:
+            if self._checkpointing or not self._pending:
+                return False
+            self._checkpointing = True
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+
+        failed, error = {}, None
+        try:
+            for shard, dims in split_shards(pending).items():
+                gran = shard.split(":", 1)[0]
+                try:
+                    self._checkpoint_shard(shard, gran, dims, load_fn, save_fn, attempts)
+                except _Superseded as s:
+                    with self._lock:
+                        self.generation = s.generation
+                        self._loaded_at = 0.0
+                    break
+                except Exception as e:
+                    error = e
+                    _merge(failed, {gran: dims})
+        finally:
+            with self._lock:
+                _merge(self._pending, failed)
+                self._inflight = {}
+                self._checkpointing = False
+                self._checkpointed_at = time.time()
+        if error is not None:
+            raise error
+        return True
+
+    def _checkpoint_shard(self, shard, gran, dims, load_fn, save_fn, attempts) -> None:
+        for _ in range(attempts):
+            doc = load_fn(shard) or {}
+            with self._lock:
+                if not self._synced:
+                    # Never loaded, so there is no way to tell; take the shard's generation.
+                    self.generation, self._synced = doc.get("generation"), True
+                elif doc.get("generation") != self.generation:
+                    raise _Superseded(doc.get("generation"))
+                generation = self.generation
+            counters = _merge({gran: doc.get("counters") or {}}, {gran: dims})
+            self._prune(counters)
+            doc.update({"counters": counters.get(gran, {}), "updated_at": datetime.now(timezone.utc).isoformat()})
+            if generation is not None:
+                doc["generation"] = generation
+            if save_fn(doc):
+                with self._lock:
+                    # The saved shard now holds these buckets; stop counting them as in flight.
+                    for dim, buckets in doc["counters"].items():
+                        self._totals.setdefault(gran, {}).setdefault(dim, {}).update(buckets)
+                    for dim, buckets in dims.items():
+                        inflight = self._inflight.get(gran, {}).get(dim, {})
+                        for bucket in buckets:
+                            inflight.pop(bucket, None)
+                    self._loaded_at = time.time()
+                return
+        raise RuntimeError(f"rollup checkpoint {shard}: too many _rev conflicts")
+
+    def flush(self, load_fn, save_fn, timeout_s: float = 5.0) -> bool:
+        """
+        Checkpoint now regardless of the interval, waiting for a running checkpoint first (shutdown).
+        """
+        deadline = time.time() + timeout_s
+        while time.time() < deadline:
+            with self._lock:
+                busy, empty = self._checkpointing, not self._pending
+            if empty and not busy:
+                return True
+            if not busy:
+                return self.checkpoint(load_fn, save_fn)
+            time.sleep(0.05)
+        return False
+
+    def replace(self, counters: dict, generation=None) -> None:
+        with self._lock:
+            self._totals = counters
+            self._pending = {}
+            self.generation, self._synced = generation, True
+            self._loaded_at = time.time()
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def refresh_due(self, interval_s: float) -> bool:
+        return time.time() - self._loaded_at >= interval_s
+
+    def load(self, docs: list) -> None:
+        """
+        Replace totals with the checkpoint shard documents. A pre-sharding document, whose
+        counters are keyed by granularity, is folded in the same way.
+        """
+        totals, generation = {}, None
+        for doc in docs or []:
+            counters = doc.get("counters") or {}
+            gran = doc.get("granularity")
+            _merge(totals, {gran: counters} if gran else counters)
+            generation = doc.get("generation") or generation
+        self._prune(totals)
+        with self._lock:
+            if self._synced and generation != self.generation:
+                # Rebuilt elsewhere since this instance last synced: its pending counts are in the rebuild.
+                self._pending = {}
+            self.generation, self._synced = generation, True
+            self._totals = totals
+            self._loaded_at = time.time()
+
+    def query(self, granularity: str, dim: str, buckets: list, key=None) -> list:
+        rows = []
+        with self._lock:
+            for bucket in buckets:
+                merged = {}
+                for src in (self._totals, self._inflight, self._pending):
+                    slot = src.get(granularity, {}).get(dim, {}).get(bucket, {})
+                    if key is None:
+                        items = slot.items()
+                    else:
+                        items = [(key, slot[key])] if key in slot else []
+                    for k, (n, portions) in items:
+                        cur = merged.get(k) or [0, 0.0]
+                        merged[k] = [cur[0] + n, cur[1] + portions]
+                for k, (n, portions) in sorted(merged.items()):
+                    rows.append({"bucket": bucket, "key": k, "dispatches": n, "portions": portions})
+        return rows
+
+    # ----------------------------
+    # Internals
+    # ----------------------------
+    def _prune(self, counters: dict) -> None:
+        now = datetime.now(timezone.utc)
+        for gran, dims in counters.items():
+            if gran not in self.retention:
+                continue
+            oldest = bucket_of((now - self.retention[gran]).isoformat(), gran)
+            for buckets in dims.values():
+                for bucket in [b for b in buckets if b < oldest]:
+                    del buckets[bucket]
+
+
+def build_counters(docs) -> dict:
+    """
+    Build counters from scratch from an iterable of audit docs (used for backfill).
+    """
+    store = RollupStore()
+    for doc in docs:
+        store.record(doc)
+    store._prune(store._pending)
+    return store._pending
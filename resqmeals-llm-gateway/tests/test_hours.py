@@ -0,0 +1,85 @@
+"""
+Case tests for the opening-hours and pickup-deadline parsers.
+
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hours import DAYS, SLOTS_PER_DAY, compile_hours, deadline_window, open_in_window  # noqa: E402
+
+MONDAY_9AM = datetime(2026, 10, 19, 9, 0)
+
+
+def open_days(bitmap) -> list:
+    day_mask = (1 << SLOTS_PER_DAY) - 1
+    return [DAYS[d] for d in range(7) if (bitmap >> (d * SLOTS_PER_DAY)) & day_mask]
+
+
+def is_open(bitmap, when: datetime) -> bool:
+    return open_in_window([bitmap], when, when)[0]
+
+
+@pytest.mark.parametrize("hours, days", [
+    ("Mon-Fri 9am-5pm, Sat 10-14", ["mon", "tue", "wed", "thu", "fri", "sat"]),
+    ("Tuesday-Thursday 10-4", ["tue", "wed", "thu"]),
+    ("thurs. 9-5", ["thu"]),
+    ("daily 08:00-20:00", DAYS),
+    ("Closed Sundays, otherwise 9-5", ["mon", "tue", "wed", "thu", "fri", "sat"]),
+    ("Mon-Fri 9-5, Sat closed", ["mon", "tue", "wed", "thu", "fri"]),
+    ({"mon": "9-17", "sat": "closed"}, ["mon"]),
+    ("24/7", DAYS),
+])
+def test_compile_hours_days(hours, days):
+    assert open_days(compile_hours(hours)) == days
+
+
+def test_compile_hours_times():
+    bitmap = compile_hours("Mon-Fri 9am-5pm")
+    assert is_open(bitmap, datetime(2026, 10, 19, 9, 0))
+    assert is_open(bitmap, datetime(2026, 10, 19, 16, 45))
+    assert not is_open(bitmap, datetime(2026, 10, 19, 17, 0))
+    assert not is_open(bitmap, datetime(2026, 10, 24, 12, 0))
+
+
+@pytest.mark.parametrize("hours", [
+    "Sat-Sun closed",
+    "Closed on Sundays",
+    "closed",
+    "call ahead",
+    "Monument St entrance",
+    "",
+    None,
+])
+def test_compile_hours_unknown(hours):
+    assert compile_hours(hours) is None
+
+
+@pytest.mark.parametrize("phrase, start, end", [
+    ("before 8pm", (19, 9, 0), (19, 20, 0)),
+    ("by 10 PM", (19, 9, 0), (19, 22, 0)),
+    ("before 8pm, Sunset Blvd entrance", (19, 9, 0), (19, 20, 0)),
+    ("at 9pm", (19, 21, 0), (19, 21, 30)),
+    ("3-5pm", (19, 15, 0), (19, 17, 0)),
+    ("after 3pm", (19, 15, 0), (20, 0, 0)),
+    ("after 8am", (19, 9, 0), (20, 0, 0)),
+    ("tomorrow by noon", (19, 9, 0), (20, 12, 0)),
+    ("Thursday after 5pm", (22, 17, 0), (23, 0, 0)),
+    ("sunday at 2pm", (25, 14, 0), (25, 14, 30)),
+    ("at 8am", (20, 8, 0), (20, 8, 30)),
+])
+def test_deadline_window(phrase, start, end):
+    def at(day, hour, minute):
+        return datetime(2026, 10, day, hour, minute)
+
+    assert deadline_window(phrase, MONDAY_9AM) == (at(*start), at(*end))
+
+
+@pytest.mark.parametrize("phrase", ["asap", "", None, "Sunset Blvd"])
+def test_deadline_window_unknown(phrase):
+    assert deadline_window(phrase, MONDAY_9AM) is None
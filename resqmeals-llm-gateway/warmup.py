@@ -0,0 +1,60 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class Warmup:
+    """
+    Runs named start-up tasks in parallel under one time budget and records how long each took.
+
+    The instance counts as ready once every task has finished or the budget has run out,
+    whichever comes first, so a slow dependency delays readiness but never blocks it forever.
+    """
+
+    def __init__(self, budget_s: float = 10.0, release: str = "dev", process_started=None):
+        self.budget_s = budget_s
+        self.release = release
+        self.process_started = process_started or time.time()
+        self.tasks = {}
+        self.timings = {}
+        self.ready = threading.Event()
+        self.report = None
+
+    def task(self, name: str, fn) -> None:
+        self.tasks[name] = fn
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
+
+    def run(self) -> dict:
+        started = time.time()
+
+        def _timed(name, fn):
+            t0 = time.time()
+            try:
+                fn()
+                self.timings[name] = {"ok": True, "ms": round((time.time() - t0) * 1000, 1)}
+            except Exception as e:
+                self.timings[name] = {"ok": False, "ms": round((time.time() - t0) * 1000, 1), "error": str(e)}
+
+        pool = ThreadPoolExecutor(max_workers=max(1, len(self.tasks)), thread_name_prefix="warmup")
+        futures = [pool.submit(_timed, name, fn) for name, fn in self.tasks.items()]
+        wait(futures, timeout=self.budget_s)
+        pool.shutdown(wait=False)
+
+        for name in self.tasks:
+            self.timings.setdefault(name, {"ok": False, "ms": None, "error": "budget exceeded"})
+
+        now = time.time()
+        self.report = {
+            "event": "startup",
+            "release": self.release,
+            "warmup_ms": round((now - started) * 1000, 1),
+            "since_process_start_ms": round((now - self.process_started) * 1000, 1),
+            "budget_s": self.budget_s,
+            "tasks": dict(self.timings),
+        }
+        self.ready.set()
+        print(json.dumps(self.report), flush=True)
+        return self.report
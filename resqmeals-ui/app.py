@@ -1,13 +1,17 @@
 UI_VERSION = "2026-02-01-ui-v2"
 
 
+import hashlib
 import json
 import os
+from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 import streamlit as st
 
+from job_feed import publish_job, submit_batched
+
 # Set this to your gateway URL.
 GATEWAY_URL = os.environ.get(
     "GATEWAY_URL",
@@ -96,56 +100,137 @@ def _format_items_summary(donation_obj: Dict[str, Any]) -> str:
     return ", ".join(parts)
 
 
+def dispatch_key_for(restaurant_id: str, message: str) -> str:
+    """
+    Stable per donation post, so clicking Dispatch again after a timeout reuses the gateway's work.
+    """
+    return hashlib.sha256(f"{restaurant_id}\n{message.strip()}".encode("utf-8")).hexdigest()[:32]
+
+
+def _post(path: str, body: Dict[str, Any], dispatch_key: Optional[str] = None, timeout: int = 60) -> requests.Response:
+    headers = {}
+    if dispatch_key:
+        step = hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        headers["Idempotency-Key"] = f"{dispatch_key}:{step}"
+    return requests.post(f"{GATEWAY_URL}{path}", json=body, headers=headers, timeout=timeout)
+
+
 # ----------------------------
 # Gateway calls
 # ----------------------------
-def extract_donation(message: str) -> Dict[str, Any]:
-    r = requests.post(f"{GATEWAY_URL}/llm/extract_donation", json={"text": message}, timeout=60)
+def extract_donation(
+    message: str,
+    restaurant_id: str,
+    allow_duplicate: bool = False,
+    dispatch_key: Optional[str] = None,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Returns (donation, duplicate_of). duplicate_of is set when the gateway matched a recent post.
+    """
+    r = _post(
+        "/llm/extract_donation",
+        {"text": message, "restaurant_id": restaurant_id, "allow_duplicate": allow_duplicate},
+        dispatch_key,
+    )
     j = _safe_json(r)
     donation = _parse_json_maybe(j.get("json"))
     if not isinstance(donation, dict):
         raise RuntimeError(f"extract_donation returned unexpected payload: {j}")
-    return donation
+    return donation, j.get("duplicate_of")
+
+
+@st.cache_resource
+def _validator_cache() -> Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]:
+    # Shared across reruns and sessions: (path, params) -> (ETag, last 200 body).
+    return {}
 
 
-def get_charities(accepts: str) -> List[Dict[str, Any]]:
-    r = requests.get(f"{GATEWAY_URL}/data/charities", params={"accepts": accepts}, timeout=30)
+def _get_with_validators(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Conditional GET: send the stored ETag and reuse the stored body on 304 Not Modified.
+    """
+    cache = _validator_cache()
+    key = (path, json.dumps(params, sort_keys=True))
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+
+    r = requests.get(f"{GATEWAY_URL}{path}", params=params, headers=headers, timeout=30)
+    if r.status_code == 304 and cached:
+        return cached[1]
     j = _safe_json(r)
+    if r.headers.get("ETag"):
+        cache[key] = (r.headers["ETag"], j)
+    return j
+
+
+def get_charities(accepts: str, restaurant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    # restaurant_id lets a city-partitioned gateway read only that restaurant's city.
+    j = _get_with_validators("/data/charities", {"accepts": accepts, "restaurant_id": restaurant_id})
     docs = j.get("docs", [])
     if not isinstance(docs, list):
         raise RuntimeError(f"data/charities returned unexpected payload: {j}")
     return docs
 
 
-def rank_charities(donation_obj: Dict[str, Any], charities: List[Dict[str, Any]]) -> Dict[str, Any]:
-    r = requests.post(
-        f"{GATEWAY_URL}/llm/rank_charities",
-        json={"donation": donation_obj, "candidates": charities},
-        timeout=60,
+def rank_charities(
+    donation_obj: Dict[str, Any],
+    charities: List[Dict[str, Any]],
+    category: Optional[str] = None,
+    dispatch_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    r = _post(
+        "/llm/rank_charities",
+        {"donation": donation_obj, "candidates": charities, "category": category},
+        dispatch_key,
     )
     j = _safe_json(r)
     return _normalize_rank_response(j)
 
 
-def get_available_drivers() -> List[Dict[str, Any]]:
-    r = requests.get(f"{GATEWAY_URL}/data/drivers", params={"status": "available"}, timeout=30)
-    j = _safe_json(r)
+def reserve_capacity(
+    charity_id: str,
+    donation_obj: Dict[str, Any],
+    category: Optional[str],
+    dispatch_key: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Hold capacity at a charity. Returns None when the charity is already full.
+    """
+    r = _post(
+        "/capacity/reserve",
+        {"charity_id": charity_id, "donation": donation_obj, "category": category},
+        dispatch_key,
+        timeout=30,
+    )
+    if r.status_code == 409:
+        return None
+    return _safe_json(r)
+
+
+def get_available_drivers(restaurant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    j = _get_with_validators("/data/drivers", {"status": "available", "restaurant_id": restaurant_id})
     docs = j.get("docs", [])
     if not isinstance(docs, list):
         raise RuntimeError(f"data/drivers returned unexpected payload: {j}")
     return docs
 
 
-def draft_driver_message(pickup: str, time_str: str, items_summary: str, accept_link: str) -> str:
-    r = requests.post(
-        f"{GATEWAY_URL}/llm/draft_driver_message",
-        json={
+def draft_driver_message(
+    pickup: str,
+    time_str: str,
+    items_summary: str,
+    accept_link: str,
+    dispatch_key: Optional[str] = None,
+) -> str:
+    r = _post(
+        "/llm/draft_driver_message",
+        {
             "pickup": pickup,
             "time": time_str,
             "items_summary": items_summary,
             "accept_link": accept_link,
         },
-        timeout=60,
+        dispatch_key,
     )
     j = _safe_json(r)
     text = j.get("text")
@@ -160,17 +245,18 @@ def generate_receipt(
     donation_obj: Dict[str, Any],
     pickup_address: str,
     pickup_deadline: str,
+    dispatch_key: Optional[str] = None,
 ) -> Dict[str, Any]:
-    r = requests.post(
-        f"{GATEWAY_URL}/llm/generate_receipt",
-        json={
+    r = _post(
+        "/llm/generate_receipt",
+        {
             "restaurant_id": restaurant_id,
             "charity": {"id": charity_doc.get("_id"), "name": charity_doc.get("name")},
             "items": donation_obj,
             "pickup_address": pickup_address,
             "pickup_deadline": pickup_deadline,
         },
-        timeout=60,
+        dispatch_key,
     )
     j = _safe_json(r)
 
@@ -194,6 +280,18 @@ def get_audit_recent(limit: int = 20) -> List[Dict[str, Any]]:
     return docs
 
 
+def get_rollup(dim: str, granularity: str = "day", key: Optional[str] = None) -> List[Dict[str, Any]]:
+    params = {"dim": dim, "granularity": granularity}
+    if key:
+        params["key"] = key
+    r = requests.get(f"{GATEWAY_URL}/stats/rollup", params=params, timeout=30)
+    j = _safe_json(r)
+    rows = j.get("rows", [])
+    if not isinstance(rows, list):
+        raise RuntimeError(f"stats/rollup returned unexpected payload: {j}")
+    return rows
+
+
 def _to_map_points(
     charities: List[Dict[str, Any]],
     drivers: List[Dict[str, Any]],
@@ -236,10 +334,12 @@ def write_audit(
     selected_driver: Dict[str, Any],
     driver_message: str,
     receipt_obj: Dict[str, Any],
+    reservation: Optional[Dict[str, Any]] = None,
+    dispatch_key: Optional[str] = None,
 ) -> str:
-    r = requests.post(
-        f"{GATEWAY_URL}/audit/log",
-        json={
+    r = _post(
+        "/audit/log",
+        {
             "restaurant_id": restaurant_id,
             "restaurant_message": restaurant_message,
             "extracted": donation_obj,
@@ -247,8 +347,10 @@ def write_audit(
             "selected_driver": selected_driver,
             "driver_message": driver_message,
             "receipt": receipt_obj,
+            "reservation": reservation,
             "status": "dispatched",
         },
+        dispatch_key,
         timeout=30,
     )
     j = _safe_json(r)
@@ -292,6 +394,17 @@ with tab_dispatch:
         height=120,
     )
 
+    allow_duplicate = st.checkbox(
+        "Dispatch even if this looks like a repeat of a recent post",
+        value=False,
+    )
+
+    batch_dispatch = st.checkbox(
+        "Batch with nearby pickups (not urgent)",
+        value=False,
+        help="Hold the job briefly so one driver can collect several nearby donations in one trip.",
+    )
+
     col1, col2 = st.columns([1, 1])
     with col1:
         dispatch = st.button("🚀 Dispatch Donation", use_container_width=True)
@@ -305,35 +418,56 @@ with tab_dispatch:
 
         try:
             with st.spinner("Running dispatch flow..."):
-                donation_obj = extract_donation(message)
+                dispatch_key = dispatch_key_for(restaurant_id, message)
+                donation_obj, duplicate_of = extract_donation(
+                    message, restaurant_id, allow_duplicate=allow_duplicate, dispatch_key=dispatch_key
+                )
+                if duplicate_of:
+                    st.warning(
+                        f"This looks like a repeat of a recent post "
+                        f"(similarity {duplicate_of.get('similarity')}). Nothing was dispatched. "
+                        "Tick the checkbox above to dispatch it anyway."
+                    )
+                    st.json(donation_obj)
+                    st.stop()
 
                 pickup_deadline = donation_obj.get("pickup_deadline") or "10 PM"
                 pickup_address = donation_obj.get("pickup_address") or ""
 
-                charities = get_charities(accepts=accepts)
+                charities = get_charities(accepts=accepts, restaurant_id=restaurant_id)
 
                 if not charities:
                     st.error("No charities found for the selected accepts filter.")
                     st.stop()
 
-                ranked_obj = rank_charities(donation_obj, charities)
-                top = ranked_obj["ranked"][0]
-                chosen_id = top.get("id") or top.get("_id")
-                if not chosen_id:
-                    st.error("Ranking did not return a charity id.")
+                category = accepts.split(",")[0].strip() or None
+                ranked_obj = rank_charities(donation_obj, charities, category=category, dispatch_key=dispatch_key)
+                if not ranked_obj["ranked"]:
+                    st.error("Every matching charity is at capacity today.")
                     st.json(ranked_obj)
                     st.stop()
 
-                selected_charity = _lookup_full_doc_by_id(charities, chosen_id)
+                # Walk down the ranking until a charity accepts the capacity reservation.
+                selected_charity, reservation = None, None
+                for top in ranked_obj["ranked"]:
+                    chosen_id = top.get("id") or top.get("_id")
+                    candidate = _lookup_full_doc_by_id(charities, chosen_id) if chosen_id else None
+                    if not candidate:
+                        continue
+                    reservation = reserve_capacity(chosen_id, donation_obj, category, dispatch_key=dispatch_key)
+                    if reservation:
+                        selected_charity = candidate
+                        break
+
                 if not selected_charity:
-                    st.error("Could not match ranked charity id to a full charity document.")
-                    st.json({"ranked_top": top, "candidate_ids": [c.get('_id') for c in charities]})
+                    st.error("No ranked charity could take this donation (unmatched ids or no capacity left).")
+                    st.json({"ranked": ranked_obj["ranked"], "candidate_ids": [c.get('_id') for c in charities]})
                     st.stop()
 
                 if not pickup_address:
                     pickup_address = selected_charity.get("address") or ""
 
-                drivers = get_available_drivers()
+                drivers = get_available_drivers(restaurant_id=restaurant_id)
                 if not drivers:
                     st.error("No available drivers found.")
                     st.stop()
@@ -352,6 +486,7 @@ with tab_dispatch:
                     time_str=pickup_deadline,
                     items_summary=items_summary,
                     accept_link=accept_link,
+                    dispatch_key=dispatch_key,
                 )
 
                 receipt_obj = generate_receipt(
@@ -360,6 +495,7 @@ with tab_dispatch:
                     donation_obj=donation_obj,
                     pickup_address=pickup_address,
                     pickup_deadline=pickup_deadline,
+                    dispatch_key=dispatch_key,
                 )
 
                 audit_id = write_audit(
@@ -370,8 +506,35 @@ with tab_dispatch:
                     selected_driver=selected_driver,
                     driver_message=driver_message,
                     receipt_obj=receipt_obj,
+                    reservation=reservation,
+                    dispatch_key=dispatch_key,
                 )
 
+                if batch_dispatch:
+                    batched = submit_batched(
+                        restaurant_id=restaurant_id,
+                        donation_obj=donation_obj,
+                        charity_doc=selected_charity,
+                        pickup_address=pickup_address,
+                        items_text=items_summary,
+                        audit_id=audit_id,
+                        reservation=reservation,
+                        idempotency_key=f"{dispatch_key}:batch:{audit_id}",
+                    )
+                    # No driver job exists while the donation is held; it gets one when the batch is planned.
+                    job = batched.get("job") or {"job_id": batched.get("job_id")}
+                else:
+                    job = publish_job(
+                        pickup_address=pickup_address,
+                        items_text=items_summary,
+                        deadline_text=pickup_deadline,
+                        charity_name=selected_charity.get("name", ""),
+                        restaurant_id=restaurant_id,
+                        audit_id=audit_id,
+                        reservation=reservation,
+                        idempotency_key=f"{dispatch_key}:job:{audit_id}",
+                    )
+
             st.success("Donation dispatched successfully.")
 
             st.subheader("📦 Donation (Extracted)")
@@ -392,6 +555,15 @@ with tab_dispatch:
             st.subheader("🗂️ Audit ID")
             st.code(audit_id)
 
+            if batch_dispatch and batched.get("queued"):
+                st.subheader("🧺 Batch")
+                st.code(batched["batch_id"])
+                release_at = datetime.fromtimestamp(batched["release_at"]).strftime("%H:%M")
+                st.info(f"Held for batch dispatch until about {release_at}. It will be published as part of a multi-stop job.")
+            else:
+                st.subheader("📣 Driver Job")
+                st.code(job["job_id"])
+
             with st.expander("Debug", expanded=False):
                 st.subheader("Ranked Output")
                 st.json(ranked_obj)
@@ -402,4 +574,28 @@ with tab_dispatch:
 
         except Exception as e:
             st.error(str(e))
-            st.info("If this persists, open the Debug expander and confirm endpoint outputs.")
\ No newline at end of file
+            st.info("If this persists, open the Debug expander and confirm endpoint outputs.")
+
+with tab_history:
+    granularity = st.radio("Bucket", ["day", "hour"], horizontal=True)
+    try:
+        totals = get_rollup("all", granularity)
+        if not totals:
+            st.info("No dispatches recorded in this period yet.")
+        else:
+            latest = totals[-1]
+            m1, m2 = st.columns(2)
+            m1.metric(f"Dispatches ({latest['bucket']})", int(latest["dispatches"]))
+            m2.metric(f"Portions rescued ({latest['bucket']})", int(latest["portions"]))
+            st.bar_chart({r["bucket"]: r["portions"] for r in totals})
+
+            st.subheader("Meals rescued per restaurant")
+            st.dataframe(get_rollup("restaurant", granularity), use_container_width=True)
+
+            st.subheader("Charity load")
+            st.dataframe(get_rollup("charity", granularity), use_container_width=True)
+
+            st.subheader("Driver utilization")
+            st.dataframe(get_rollup("driver", granularity), use_container_width=True)
+    except Exception as e:
+        st.error(str(e))
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+GATEWAY_URL = os.environ.get(
+    "GATEWAY_URL",
+    "https://resqmeals-llm-gateway.25rqfbmcob70.br-sao.codeengine.appdomain.cloud",
+).rstrip("/")
+
+# Long-poll wait of the Driver Console's background listener; keep under the gateway's JOB_FEED_MAX_WAIT_S.
+LIVE_FEED_WAIT_S = float(os.environ.get("LIVE_FEED_WAIT_S", "20"))
+# The listener stops once the console has not rendered the feed for this long (tab closed).
+LIVE_FEED_IDLE_S = float(os.environ.get("LIVE_FEED_IDLE_S", "60"))
+
+
+def new_feed() -> Dict[str, Any]:
+    return {
+        "seq": 0,
+        "epoch": None,
+        "jobs": {},
+        "version": 0,
+        "error": None,
+        "seen_at": time.time(),
+        "lock": threading.Lock(),
+        "stop": threading.Event(),
+        "thread": None,
+    }
+
+
+def publish_job(
+    pickup_address: str,
+    items_text: str,
+    deadline_text: str,
+    charity_name: str,
+    restaurant_id: str,
+    audit_id: Optional[str] = None,
+    reservation: Optional[Dict[str, Any]] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    r = requests.post(
+        f"{GATEWAY_URL}/jobs",
+        json={
+            "pickup_address": pickup_address,
+            "items": items_text,
+            "deadline": deadline_text,
+            "charity": charity_name,
+            "restaurant_id": restaurant_id,
+            "audit_id": audit_id,
+            "reservation": reservation,
+        },
+        headers={"Idempotency-Key": idempotency_key} if idempotency_key else {},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+def submit_batched(
+    restaurant_id: str,
+    donation_obj: Dict[str, Any],
+    charity_doc: Dict[str, Any],
+    pickup_address: str,
+    items_text: str,
+    audit_id: Optional[str] = None,
+    reservation: Optional[Dict[str, Any]] = None,
+    urgent: bool = False,
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Hand a reserved donation to the gateway's batch dispatcher instead of publishing it alone.
+    Returns {"queued": True, "release_at": ...} while it is held, or the plans/job once published.
+    """
+    r = requests.post(
+        f"{GATEWAY_URL}/dispatch/batch/submit",
+        json={
+            "restaurant_id": restaurant_id,
+            "donation": donation_obj,
+            "charity": charity_doc,
+            "pickup_address": pickup_address,
+            "items": items_text,
+            "audit_id": audit_id,
+            "reservation": reservation,
+            "urgent": urgent,
+        },
+        headers={"Idempotency-Key": idempotency_key} if idempotency_key else {},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return r.json()
+
+
+def accept_remote_job(job_id: str, driver_id: str, driver_name: str) -> Tuple[bool, str]:
+    r = requests.post(
+        f"{GATEWAY_URL}/jobs/{job_id}/accept",
+        json={"driver_id": driver_id, "driver_name": driver_name},
+        timeout=30,
+    )
+    if r.status_code in (404, 409):
+        return False, r.json().get("error", "Job is no longer open.")
+    r.raise_for_status()
+    return True, "Accepted."
+
+
+def get_drivers() -> List[Dict[str, Any]]:
+    r = requests.get(f"{GATEWAY_URL}/data/drivers", params={"status": "available"}, timeout=30)
+    r.raise_for_status()
+    docs = r.json().get("docs", [])
+    return docs if isinstance(docs, list) else []
+
+
+def poll_job_changes(
+    feed: Dict[str, Any],
+    geo: Optional[Dict[str, Any]] = None,
+    radius_miles: Optional[float] = None,
+    wait_s: float = LIVE_FEED_WAIT_S,
+) -> int:
+    """
+    Poll the gateway for job deltas since feed["seq"] and apply them in place.
+    Returns the number of changes applied.
+    """
+    params: Dict[str, Any] = {"since": feed["seq"], "wait": wait_s}
+    if feed.get("epoch"):
+        params["epoch"] = feed["epoch"]
+    if geo and geo.get("lat") is not None and geo.get("lon") is not None and radius_miles:
+        params.update({"lat": geo["lat"], "lon": geo["lon"], "radius_miles": radius_miles})
+
+    r = requests.get(f"{GATEWAY_URL}/jobs/changes", params=params, timeout=wait_s + 15)
+    r.raise_for_status()
+    with feed["lock"]:
+        applied = apply_job_changes(feed, r.json())
+        if applied:
+            feed["version"] += 1
+    return applied
+
+
+def ensure_feed_listener(
+    feed: Dict[str, Any],
+    geo: Optional[Dict[str, Any]] = None,
+    radius_miles: Optional[float] = None,
+) -> None:
+    """
+    Keep a background thread long-polling /jobs/changes into `feed`, so page reruns never
+    wait on the gateway. The thread exits when feed["stop"] is set or the feed goes unseen
+    for LIVE_FEED_IDLE_S; calling this again restarts it.
+    """
+    feed["seen_at"] = time.time()
+    if feed["thread"] is not None and feed["thread"].is_alive():
+        return
+
+    def listen():
+        while not feed["stop"].is_set() and time.time() - feed["seen_at"] < LIVE_FEED_IDLE_S:
+            try:
+                poll_job_changes(feed, geo=geo, radius_miles=radius_miles)
+                feed["error"] = None
+            except Exception as e:
+                feed["error"] = str(e)
+                feed["stop"].wait(2)
+
+    feed["thread"] = threading.Thread(target=listen, name="job-feed", daemon=True)
+    feed["thread"].start()
+
+
+def open_jobs(feed: Dict[str, Any], limit: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Total open jobs and the newest `limit` of them, read consistently with the listener.
+    """
+    with feed["lock"]:
+        jobs = list(feed["jobs"].values())
+    jobs.sort(key=lambda j: j["created_at"], reverse=True)
+    return len(jobs), jobs[:limit]
+
+
+def apply_job_changes(feed: Dict[str, Any], changes: Dict[str, Any]) -> int:
+    jobs = feed["jobs"]
+    applied = 0
+
+    if changes.get("reset"):
+        jobs.clear()
+        for job in changes.get("jobs", []):
+            jobs[job["job_id"]] = job
+        applied = len(jobs) + 1
+
+    for e in changes.get("events", []):
+        if e["kind"] == "new":
+            jobs[e["job_id"]] = e["job"]
+        else:
+            jobs.pop(e["job_id"], None)
+        applied += 1
+
+    feed["seq"] = changes.get("seq", feed["seq"])
+    feed["epoch"] = changes.get("epoch", feed.get("epoch"))
+    return applied
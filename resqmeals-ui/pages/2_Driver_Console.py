@@ -1,41 +1,111 @@
+import os
+from datetime import datetime, timezone, timedelta
+
 import streamlit as st
-from mock_store import init_state, list_open_jobs, accept_job
+from mock_store import init_state
+from job_feed import accept_remote_job, ensure_feed_listener, get_drivers, new_feed, open_jobs
 
 st.set_page_config(page_title="Driver Console", page_icon="🚗", layout="wide")
 
+LIVE_FEED_REFRESH_S = float(os.environ.get("LIVE_FEED_REFRESH_S", "1"))
+LIVE_FEED_MAX_JOBS = int(os.environ.get("LIVE_FEED_MAX_JOBS", "50"))
+
 init_state(st)
+if "lock" not in st.session_state.get("job_feed", {}):
+    st.session_state.job_feed = new_feed()
 
-st.title("Driver Console (mock)")
-st.caption("Accept open pickup jobs. This simulates SMS replies.")
+st.title("Driver Console")
+st.caption("Accept open pickup jobs. New, accepted and expired jobs stream in live from the gateway.")
+
+try:
+    drivers = get_drivers() or st.session_state.drivers_mock
+except Exception:
+    drivers = st.session_state.drivers_mock
 
-drivers = st.session_state.drivers_mock
 driver_name = st.selectbox("Driver identity", [d["name"] for d in drivers], index=0)
 driver = next(d for d in drivers if d["name"] == driver_name)
+driver_id = driver.get("_id") or driver.get("id")
+
+radius_miles = st.slider(
+    "Pickup radius (miles)",
+    min_value=1,
+    max_value=50,
+    value=int(driver.get("max_radius_miles") or 10),
+    disabled=not driver.get("geo"),
+    help="Only jobs within this radius of the driver's position are shown.",
+)
 
-open_jobs = list_open_jobs(st)
+# A new identity or radius means a different filter, so start the feed over.
+feed_key = (driver_id, radius_miles)
+if st.session_state.get("job_feed_key") != feed_key:
+    st.session_state.job_feed["stop"].set()
+    st.session_state.job_feed = new_feed()
+    st.session_state.job_feed_key = feed_key
+
+feed = st.session_state.job_feed
+# Deltas arrive on a background long-poll; reruns only read the feed.
+ensure_feed_listener(feed, geo=driver.get("geo"), radius_miles=radius_miles)
+
+if st.session_state.get("accept_flash"):
+    st.success(st.session_state.pop("accept_flash"))
 
 col1, col2 = st.columns([2, 1], gap="large")
 
-with col1:
-    st.subheader("Open jobs")
-    if not open_jobs:
-        st.info("No open jobs right now. Create one from the Dispatch Center page.")
-    else:
-        for job in open_jobs:
-            with st.container(border=True):
-                st.write(f"Job id: {job['job_id']}")
-                st.write(f"Pickup: {job['pickup_address']}")
-                st.write(f"Items: {job['items']}")
-                st.write(f"Deadline: {job['deadline']}")
-                st.write(f"Charity: {job['charity']}")
-
-                if st.button(f"Accept {job['job_id']}", key=f"accept_{job['job_id']}"):
-                    ok, msg = accept_job(st, job["job_id"], driver["id"], driver["name"])
-                    if ok:
-                        st.success(f"{msg} Assigned to {driver['name']}.")
-                        st.rerun()
+
+@st.fragment(run_every=timedelta(seconds=LIVE_FEED_REFRESH_S))
+def open_jobs_panel():
+    # Only this panel reruns on the timer, and it draws at most LIVE_FEED_MAX_JOBS jobs, so
+    # the refresh cost does not grow with the number of open jobs.
+    ensure_feed_listener(feed, geo=driver.get("geo"), radius_miles=radius_miles)
+    total, jobs = open_jobs(feed, LIVE_FEED_MAX_JOBS)
+    st.subheader(f"Open jobs ({total})")
+    if feed["error"]:
+        st.warning(f"Live feed unavailable: {feed['error']}")
+    if not jobs:
+        st.info("No open jobs right now. Dispatch one from the Dispatch Center page.")
+        return
+    if total > len(jobs):
+        st.caption(f"Showing the newest {len(jobs)}.")
+
+    for job in jobs:
+        with st.container(border=True):
+            st.write(f"Job id: {job['job_id']}")
+            if job.get("stops"):
+                # Multi-stop job from the batch dispatcher: pickups in order, then drop-offs.
+                st.write(f"Route: {len(job['stops'])} stops, about {job.get('distance_miles')} miles")
+                if job.get("suggested_driver") == driver_id:
+                    st.caption("Planned for you.")
+                for n, stop in enumerate(job["stops"], start=1):
+                    if stop["kind"] == "pickup":
+                        st.write(f"{n}. Pick up {stop.get('items') or ''} at {stop.get('address')} (by {stop.get('deadline')})")
                     else:
-                        st.warning(msg)
+                        st.write(f"{n}. Drop off at {stop.get('charity')}, {stop.get('address')}")
+            else:
+                st.write(f"Pickup: {job.get('pickup_address')}")
+                st.write(f"Items: {job.get('items')}")
+                st.write(f"Deadline: {job.get('deadline')}")
+                st.write(f"Charity: {job.get('charity')}")
+
+            if st.button(f"Accept {job['job_id']}", key=f"accept_{job['job_id']}"):
+                ok, msg = accept_remote_job(job["job_id"], driver_id, driver["name"])
+                if ok:
+                    with feed["lock"]:
+                        feed["jobs"].pop(job["job_id"], None)
+                    st.session_state.jobs.insert(0, {
+                        **job,
+                        "status": "accepted",
+                        "accepted_by": {"id": driver_id, "name": driver["name"]},
+                        "accepted_at": datetime.now(timezone.utc).isoformat(),
+                    })
+                    # Full rerun so the history column picks up the accepted job.
+                    st.session_state.accept_flash = f"{msg} Assigned to {driver['name']}."
+                    st.rerun()
+                else:
+                    st.warning(msg)
+
+
+with col1:
+    open_jobs_panel()
 
 with col2:
     st.subheader("Accepted / history")
@@ -48,3 +118,5 @@ with col2:
                 st.write(f"{j['job_id']} accepted by {j['accepted_by']['name']}")
                 st.write(f"Accepted at: {j['accepted_at']}")
                 st.write(f"Pickup: {j['pickup_address']}")
+                if j.get("stops"):
+                    st.write(f"Stops: {len(j['stops'])}")